@@ -0,0 +1,277 @@
+import logging
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен: без него отчёты строятся только через SQL
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Колоночный расчёт аналитики на NumPy для длинных периодов ("За месяц", "За всё время").
+# Выполненные задачи один раз загружаются в массивы (employee_id, task_id, end_time,
+# points_earned, duration_seconds), а затем только дочитываются новые строки
+# (id больше последнего загруженного; перенос в архив id не меняет). Группировки по сотрудникам, задачам,
+# категориям и дням недели считаются векторно, плюс медиана, p90 и p99 времени выполнения,
+# которые в SQLite дёшево не посчитать.
+# Функции get_*_analytics возвращают строки в том же виде, что и одноимённые функции
+# queries, с тремя дополнительными столбцами: медиана, p90 и p99 времени в минутах.
+
+SECONDS_PER_DAY = 86400
+
+# Начальная ёмкость массивов; при нехватке места ёмкость удваивается
+_INITIAL_CAPACITY = 1024
+
+# Сколько строк читается из базы за раз: при первой загрузке в памяти одновременно
+# находятся массивы и не больше стольких строк-кортежей
+_FETCH_CHUNK_ROWS = 50000
+
+# Конец открытого периода ("по настоящее время")
+_END_OF_TIME = 2 ** 53
+
+
+# Доступен ли колоночный расчёт (установлен ли NumPy)
+def available():
+    return np is not None
+
+
+# Выполненные задачи в колоночном виде. Массивы общие для всех потоков чтения,
+# дочитывание новых строк выполняется под блокировкой.
+class ColumnarStore:
+    COLUMNS = (
+        ('employee_id', 'int32'),
+        ('task_id', 'int32'),
+        ('end_time', 'int64'),
+        ('points_earned', 'int32'),
+        ('duration_seconds', 'float64'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    # Сброс загруженных данных; при следующем обращении всё загрузится заново
+    def reset(self):
+        with self._lock:
+            self._last_id = 0
+            self._size = 0
+            self._columns = None
+
+    def _append(self, rows):
+        count = len(rows)
+        if self._columns is None:
+            capacity = max(_INITIAL_CAPACITY, count)
+            self._columns = {name: np.empty(capacity, dtype) for name, dtype in self.COLUMNS}
+
+        capacity = len(self._columns['end_time'])
+        if self._size + count > capacity:
+            while self._size + count > capacity:
+                capacity *= 2
+            for name, dtype in self.COLUMNS:
+                grown = np.empty(capacity, dtype)
+                grown[:self._size] = self._columns[name][:self._size]
+                self._columns[name] = grown
+
+        data = np.array(rows, dtype='float64')
+        for index, (name, dtype) in enumerate(self.COLUMNS, start=1):
+            self._columns[name][self._size:self._size + count] = data[:, index]
+
+        self._size += count
+        self._last_id = int(data[-1, 0])
+
+    # Дочитывание новых выполненных задач и срез загруженных столбцов.
+    # Срезы не меняются при последующих дочитываниях (новые строки пишутся за их пределами).
+    def refresh(self, conn):
+        with self._lock:
+            cursor = conn.execute("""
+                SELECT id, employee_id, task_id, end_time, points_earned, duration_seconds
+                FROM all_completed_tasks
+                WHERE id > ?
+                ORDER BY id
+            """, (self._last_id,))
+            added = 0
+            while True:
+                rows = cursor.fetchmany(_FETCH_CHUNK_ROWS)
+                if not rows:
+                    break
+                self._append(rows)
+                added += len(rows)
+            if added:
+                logger.debug(f"В колоночное хранилище аналитики добавлено строк: {added}")
+
+            if self._columns is None:
+                return {name: np.empty(0, dtype) for name, dtype in self.COLUMNS}
+            return {name: column[:self._size] for name, column in self._columns.items()}
+
+
+# Перцентили значений values по группам groups (целые числа от 0 до size - 1),
+# с линейной интерполяцией как в numpy.percentile. Для пустых групп - NaN.
+def _group_percentiles(groups, values, size, quantiles):
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=size)
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+
+    result = []
+    for quantile in quantiles:
+        position = quantile * (counts[present] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        low_values = sorted_values[starts[present] + lower]
+        high_values = sorted_values[starts[present] + upper]
+
+        percentile = np.full(size, np.nan)
+        percentile[present] = low_values + (high_values - low_values) * (position - lower)
+        result.append(percentile)
+    return result
+
+
+# Сводка по группам: количество, сумма очков, сумма времени, медиана, p90 и p99 времени
+def _group_totals(groups, points, durations, size):
+    counts = np.bincount(groups, minlength=size)
+    points_sum = np.bincount(groups, weights=points, minlength=size)
+    duration_sum = np.bincount(groups, weights=durations, minlength=size)
+    median, p90, p99 = _group_percentiles(groups, durations, size, (0.5, 0.9, 0.99))
+    return counts, points_sum, duration_sum, median, p90, p99
+
+
+def _minutes(value):
+    return None if np.isnan(value) else float(value) / 60.0
+
+
+# Выполненные задачи за период [start_date, end_date)
+def _period_columns(conn, start_date, end_date):
+    columns = _store.refresh(conn)
+    if end_date is None:
+        end_date = _END_OF_TIME
+
+    end_time = columns['end_time']
+    mask = (end_time >= start_date) & (end_time < end_date)
+    return {name: column[mask] for name, column in columns.items()}
+
+
+# Аналитика по сотрудникам, как queries.get_employee_analytics, плюс медиана, p90 и p99
+def get_employee_analytics(conn, start_date, end_date=None, show_all=False):
+    query = "SELECT id, name, salary, active FROM employees"
+    if not show_all:
+        query += " WHERE active = 1"
+    employees = conn.execute(query).fetchall()
+
+    period = _period_columns(conn, start_date, end_date)
+    employee_ids = period['employee_id']
+    size = max([emp_id for emp_id, _, _, _ in employees] + [int(employee_ids.max(initial=0))]) + 1
+    counts, points, durations, median, p90, p99 = _group_totals(
+        employee_ids, period['points_earned'], period['duration_seconds'], size
+    )
+
+    rows = []
+    for emp_id, name, salary, active in employees:
+        completed = int(counts[emp_id])
+        if completed:
+            rows.append((
+                emp_id, name, completed, int(points[emp_id]),
+                float(durations[emp_id]) / completed / 60.0, float(durations[emp_id]) / 3600.0,
+                salary, active, _minutes(median[emp_id]), _minutes(p90[emp_id]), _minutes(p99[emp_id]),
+            ))
+        else:
+            rows.append((emp_id, name, 0, None, None, None, salary, active, None, None, None))
+
+    # Как ORDER BY total_points DESC в SQLite: сотрудники без задач в конце
+    rows.sort(key=lambda row: -1 if row[3] is None else row[3], reverse=True)
+    return rows
+
+
+# Аналитика по задачам, как queries.get_task_analytics, плюс медиана, p90 и p99
+def get_task_analytics(conn, start_date, end_date=None):
+    tasks = conn.execute("SELECT id, name, category, points FROM tasks").fetchall()
+
+    period = _period_columns(conn, start_date, end_date)
+    task_ids = period['task_id']
+    size = max([task_id for task_id, _, _, _ in tasks] + [int(task_ids.max(initial=0))]) + 1
+    counts, _, durations, median, p90, p99 = _group_totals(
+        task_ids, period['points_earned'], period['duration_seconds'], size
+    )
+
+    rows = []
+    for task_id, name, category, task_points in tasks:
+        completed = int(counts[task_id])
+        avg_duration = float(durations[task_id]) / completed / 60.0 if completed else None
+        rows.append((
+            task_id, name, category, completed, avg_duration, task_points,
+            _minutes(median[task_id]), _minutes(p90[task_id]), _minutes(p99[task_id]),
+        ))
+
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+
+# Общая статистика по активным сотрудникам, как queries.get_general_analytics
+def get_general_analytics(conn, start_date, end_date=None):
+    active_ids = [row[0] for row in conn.execute("SELECT id FROM employees WHERE active = 1")]
+    tasks = conn.execute("SELECT id, category FROM tasks").fetchall()
+
+    period = _period_columns(conn, start_date, end_date)
+    employee_ids = period['employee_id']
+    size = max(active_ids + [int(employee_ids.max(initial=0))]) + 1
+    is_active = np.zeros(size, dtype=bool)
+    is_active[active_ids] = True
+
+    active = is_active[employee_ids]
+    employee_ids = employee_ids[active]
+    task_ids = period['task_id'][active]
+    points = period['points_earned'][active]
+    durations = period['duration_seconds'][active]
+    end_time = period['end_time'][active]
+
+    completed = len(employee_ids)
+    if completed:
+        general_stats = (
+            len(np.unique(employee_ids)), completed, int(points.sum()),
+            float(durations.sum()) / completed / 60.0, float(durations.sum()) / 3600.0,
+        )
+    else:
+        general_stats = (0, 0, None, None, None)
+
+    # Категории: задачи, удалённые из справочника, не учитываются
+    categories = sorted({category for _, category in tasks})
+    category_index = {category: index for index, category in enumerate(categories)}
+    task_size = max([task_id for task_id, _ in tasks] + [int(task_ids.max(initial=0))]) + 1
+    task_category = np.full(task_size, -1, dtype=np.int64)
+    for task_id, category in tasks:
+        task_category[task_id] = category_index[category]
+
+    row_category = task_category[task_ids]
+    known = row_category >= 0
+    category_counts = np.bincount(row_category[known], minlength=len(categories))
+    category_points = np.bincount(row_category[known], weights=points[known], minlength=len(categories))
+    category_durations = np.bincount(row_category[known], weights=durations[known], minlength=len(categories))
+
+    category_stats = [
+        (category, int(category_counts[index]), int(category_points[index]),
+         float(category_durations[index]) / int(category_counts[index]) / 60.0)
+        for index, category in enumerate(categories)
+        if category_counts[index]
+    ]
+    category_stats.sort(key=lambda row: row[2], reverse=True)
+
+    # 1970-01-01 - четверг, день недели считается от воскресенья (0), как strftime('%w')
+    weekdays = (end_time // SECONDS_PER_DAY + 4) % 7
+    day_counts = np.bincount(weekdays, minlength=7)
+    day_points = np.bincount(weekdays, weights=points, minlength=7)
+    day_stats = [
+        (weekday, int(day_counts[weekday]), int(day_points[weekday]))
+        for weekday in range(7)
+        if day_counts[weekday]
+    ]
+
+    return general_stats, category_stats, day_stats
+
+
+_store = ColumnarStore() if np is not None else None
+
+
+# Сброс загруженных данных (после пересчёта сводок или ручной правки базы)
+def reset():
+    if _store is not None:
+        _store.reset()
@@ -0,0 +1,238 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import analytics_columnar
+import database
+import queries
+
+# Расчёт отчётов аналитики без привязки к Telegram.
+# Функции принимают соединение с базой (как функции queries) и период [start, end)
+# в метках времени базы (см. database.to_timestamp), end=None - по настоящее время.
+# Результат - объекты отчётов с уже посчитанными показателями; текст для Telegram
+# строит analytics_render. Обработчики вызывают их через database.run_read.
+# Длинные периоды при установленном NumPy считаются колоночным движком
+# (analytics_columnar), который дополнительно даёт медиану, p90 и p99 времени выполнения.
+# При расчёте через SQL квантили времени по задачам берутся из скетчей (см. sketches).
+
+# Рабочих часов в месяц для расчёта стоимости очка (8 часов * 20 дней)
+MONTHLY_WORK_HOURS = 160
+
+# Периоды не короче этого числа дней считаются колоночным движком, если установлен NumPy;
+# None - всегда считать через SQL
+COLUMNAR_MIN_DAYS = 28
+
+
+@dataclass
+class EmployeeStats:
+    employee_id: int
+    name: str
+    completed: int
+    points: int
+    avg_duration: float  # минуты
+    total_hours: float
+    salary: float
+    active: bool
+    points_per_hour: float
+    salary_per_point: float
+    median_duration: Optional[float] = None  # минуты
+    p90_duration: Optional[float] = None
+    p99_duration: Optional[float] = None
+
+
+@dataclass
+class EmployeeReport:
+    start: int
+    end: Optional[int]
+    show_all: bool
+    employees: List[EmployeeStats] = field(default_factory=list)
+
+
+@dataclass
+class TaskStats:
+    task_id: int
+    name: str
+    category: str
+    completed: int
+    avg_duration: float  # минуты
+    points: int
+    median_duration: Optional[float] = None  # минуты
+    p90_duration: Optional[float] = None
+    p99_duration: Optional[float] = None
+
+
+@dataclass
+class TaskReport:
+    start: int
+    end: Optional[int]
+    tasks: List[TaskStats] = field(default_factory=list)
+
+
+@dataclass
+class CategoryStats:
+    category: str
+    completed: int
+    points: int
+    avg_duration: float  # минуты
+
+
+@dataclass
+class WeekdayStats:
+    weekday: int  # 0 - воскресенье
+    completed: int
+    points: int
+
+
+@dataclass
+class GeneralReport:
+    start: int
+    end: Optional[int]
+    active_employees: int
+    completed: int
+    points: int
+    avg_duration: float  # минуты
+    total_hours: float
+    categories: List[CategoryStats] = field(default_factory=list)
+    weekdays: List[WeekdayStats] = field(default_factory=list)
+
+
+# Источник строк отчёта для периода: queries (SQL по сводкам) или analytics_columnar
+def _source(start, end):
+    if COLUMNAR_MIN_DAYS is None or not analytics_columnar.available():
+        return queries
+
+    period_end = end if end is not None else database.now_timestamp()
+    if period_end - start >= COLUMNAR_MIN_DAYS * 86400:
+        return analytics_columnar
+    return queries
+
+
+# Медиана, p90 и p99 времени из дополнительных столбцов строки (есть только у колоночного движка)
+def _percentiles(row, width):
+    if len(row) > width:
+        return tuple(row[width:width + 3])
+    return None, None, None
+
+
+# Медиана, p90 и p99 по скетчу времени выполнения, в минутах
+def _sketch_percentiles(sketch):
+    if sketch is None or not sketch.total:
+        return None, None, None
+    return tuple(sketch.quantile(q) / 60.0 for q in (0.5, 0.9, 0.99))
+
+
+# Эффективность сотрудника (очков в час)
+def points_per_hour(completed, points, avg_duration, total_hours):
+    # Если времени работы мало, используем среднее время на задачу для расчета
+    if completed > 0 and avg_duration > 0:
+        # Сколько задач можно выполнить за час при текущей скорости
+        tasks_per_hour = 60 / avg_duration
+        # Сколько очков можно заработать за час
+        return round((points / completed) * tasks_per_hour, 2)
+    if total_hours > 0:
+        # Стандартный расчет, если есть время работы
+        return round(points / total_hours, 2)
+    return 0
+
+
+# Стоимость очка (руб/очко) по месячной зарплате и ожидаемому количеству очков за месяц
+def salary_per_point(salary, points_per_hour):
+    if points_per_hour > 0:
+        monthly_points_estimate = points_per_hour * MONTHLY_WORK_HOURS
+        return round(salary / monthly_points_estimate, 2)
+    return 0
+
+
+# Отчёт по сотрудникам; show_all - включая неактивных
+def employee_report(conn, start, end=None, show_all=False):
+    report = EmployeeReport(start=start, end=end, show_all=show_all)
+
+    for row in _source(start, end).get_employee_analytics(conn, start, end, show_all):
+        emp_id, name, completed, points, avg_duration, total_hours, salary, active = row[:8]
+        median_duration, p90_duration, p99_duration = _percentiles(row, 8)
+
+        # Преобразуем None в 0 для безопасных вычислений
+        completed = completed or 0
+        points = points or 0
+        avg_duration = avg_duration or 0
+        total_hours = total_hours or 0
+
+        efficiency = points_per_hour(completed, points, avg_duration, total_hours)
+        report.employees.append(EmployeeStats(
+            employee_id=emp_id,
+            name=name,
+            completed=completed,
+            points=points,
+            avg_duration=avg_duration,
+            total_hours=total_hours,
+            salary=salary,
+            active=bool(active),
+            points_per_hour=efficiency,
+            salary_per_point=salary_per_point(salary, efficiency),
+            median_duration=median_duration,
+            p90_duration=p90_duration,
+            p99_duration=p99_duration,
+        ))
+
+    return report
+
+
+# Отчёт по задачам
+def task_report(conn, start, end=None):
+    report = TaskReport(start=start, end=end)
+    source = _source(start, end)
+    duration_sketches = {}
+    if source is queries:
+        duration_sketches = queries.get_task_duration_sketches(conn, start, end)
+
+    for row in source.get_task_analytics(conn, start, end):
+        task_id, name, category, completed, avg_duration, points = row[:6]
+        if source is queries:
+            median_duration, p90_duration, p99_duration = _sketch_percentiles(duration_sketches.get(task_id))
+        else:
+            median_duration, p90_duration, p99_duration = _percentiles(row, 6)
+        report.tasks.append(TaskStats(
+            task_id=task_id,
+            name=name,
+            category=category,
+            completed=completed or 0,
+            avg_duration=avg_duration or 0,
+            points=points,
+            median_duration=median_duration,
+            p90_duration=p90_duration,
+            p99_duration=p99_duration,
+        ))
+
+    return report
+
+
+# Общая статистика по активным сотрудникам с разбивкой по категориям и дням недели
+def general_report(conn, start, end=None):
+    general_stats, category_stats, day_stats = _source(start, end).get_general_analytics(conn, start, end)
+    active_employees, completed, points, avg_duration, total_hours = general_stats
+
+    report = GeneralReport(
+        start=start,
+        end=end,
+        active_employees=active_employees or 0,
+        completed=completed or 0,
+        points=points or 0,
+        avg_duration=avg_duration or 0,
+        total_hours=total_hours or 0,
+    )
+
+    for category, count, category_points, category_avg in category_stats:
+        report.categories.append(CategoryStats(
+            category=category,
+            completed=count or 0,
+            points=category_points or 0,
+            avg_duration=category_avg or 0,
+        ))
+
+    for weekday, count, day_points in day_stats:
+        report.weekdays.append(WeekdayStats(
+            weekday=int(weekday),
+            completed=count or 0,
+            points=day_points or 0,
+        ))
+
+    return report
@@ -0,0 +1,127 @@
+# Оформление отчётов analytics_engine в текст сообщений Telegram (Markdown).
+# period_name - название периода в родительном падеже после "за" ("сегодня", "всё время").
+# Отчёт строится генератором разделов (заголовок, сотрудник, задача, блок статистики),
+# каждый раздел - законченный фрагмент Markdown. pack_messages собирает разделы
+# в сообщения не длиннее лимита Telegram, не разрывая разметку внутри раздела.
+
+WEEKDAY_NAMES = ["Воскресенье", "Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+# Длина текста так, как её считает Telegram (в единицах UTF-16: эмодзи занимают две)
+def message_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+# Разбиение слишком длинного раздела по строкам (разметка в отчётах не переходит через строку)
+def _split_section(section, limit):
+    part = ""
+    for line in section.splitlines(keepends=True):
+        while message_length(line) > limit:
+            # Строка длиннее сообщения - режем как есть
+            if part:
+                yield part
+                part = ""
+            yield line[:limit // 2]
+            line = line[limit // 2:]
+        if part and message_length(part) + message_length(line) > limit:
+            yield part
+            part = ""
+        part += line
+    if part:
+        yield part
+
+
+# Сборка разделов в сообщения не длиннее limit. Генератор: каждое сообщение отдаётся,
+# как только набрано, поэтому первое можно отправить до того, как построены остальные разделы.
+def pack_messages(sections, limit=MESSAGE_LIMIT):
+    message = ""
+    for section in sections:
+        if message_length(section) > limit:
+            pieces = _split_section(section, limit)
+        else:
+            pieces = [section]
+
+        for piece in pieces:
+            if message and message_length(message) + message_length(piece) > limit:
+                yield message
+                message = ""
+            message += piece
+    if message:
+        yield message
+
+
+# Разделы отчёта по сотрудникам
+def employee_report_sections(report, period_name):
+    header = f"📊 *Аналитика по сотрудникам за {period_name}*\n"
+    if report.show_all:
+        header += "_(показаны все сотрудники, включая неактивных)_\n\n"
+    else:
+        header += "_(показаны только активные сотрудники)_\n\n"
+    yield header
+
+    for emp in report.employees:
+        status = "✅ Активен" if emp.active else "❌ Неактивен"
+        section = f"*{emp.name}* (ID: {emp.employee_id}) - {status}\n"
+        section += f"📝 Выполнено задач: {emp.completed}\n"
+        section += f"🏆 Всего очков: {emp.points}\n"
+        section += f"⏱ Среднее время на задачу: {round(emp.avg_duration, 2)} мин.\n"
+        if emp.median_duration is not None:
+            section += f"⏱ Медиана: {round(emp.median_duration, 2)} мин., p90: {round(emp.p90_duration, 2)} мин.\n"
+        section += f"⌛ Общее время работы: {round(emp.total_hours, 2)} ч.\n"
+        section += f"📈 Эффективность: {emp.points_per_hour} очков/час\n"
+        section += f"💰 Стоимость очка: {emp.salary_per_point} руб.\n\n"
+        yield section
+
+
+# Разделы отчёта по задачам, сгруппированного по категориям
+def task_report_sections(report, period_name):
+    yield f"📊 *Аналитика по задачам за {period_name}*\n\n"
+
+    current_category = None
+    for task in report.tasks:
+        section = ""
+        # Заголовок категории идёт в одном разделе с первой задачей, чтобы не остаться
+        # в конце сообщения отдельно от своих задач
+        if task.category != current_category:
+            section += f"\n*{task.category}*\n"
+            current_category = task.category
+
+        section += f"• {task.name} ({task.points} очков)\n"
+        section += f"  Выполнено: {task.completed} раз\n"
+        section += f"  Среднее время: {round(task.avg_duration, 2)} мин.\n"
+        if task.median_duration is not None:
+            section += (
+                f"  Медиана: {round(task.median_duration, 2)} мин., p90: {round(task.p90_duration, 2)} мин., "
+                f"p99: {round(task.p99_duration, 2)} мин.\n"
+            )
+        yield section
+
+
+# Разделы общей статистики
+def general_report_sections(report, period_name):
+    header = f"📊 *Общая статистика за {period_name}*\n\n"
+    header += f"👥 Активных сотрудников: {report.active_employees}\n"
+    header += f"📝 Всего выполнено задач: {report.completed}\n"
+    header += f"🏆 Всего заработано очков: {report.points}\n"
+    header += f"⏱ Среднее время на задачу: {round(report.avg_duration, 2)} мин.\n"
+    header += f"⌛ Общее время работы: {round(report.total_hours, 2)} ч.\n\n"
+    yield header
+
+    if report.categories:
+        section = "*Статистика по категориям:*\n"
+        for category in report.categories:
+            section += (
+                f"• {category.category}: {category.completed} задач, {category.points} очков, "
+                f"{round(category.avg_duration, 2)} мин. в среднем\n"
+            )
+        section += "\n"
+        yield section
+
+    if report.weekdays:
+        section = "*Статистика по дням недели:*\n"
+        for day in report.weekdays:
+            section += f"• {WEEKDAY_NAMES[day.weekday]}: {day.completed} задач, {day.points} очков\n"
+        yield section
@@ -0,0 +1,198 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict
+
+from telegram import ReplyKeyboardMarkup
+
+import database
+import queries
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд готовый отчёт аналитики считается актуальным
+ANALYTICS_CACHE_TTL = 300
+
+# Заранее построенные отчёты аналитики (см. main.precompute_analytics):
+# время суток (местное время магазина), когда отчёты строятся по расписанию
+ANALYTICS_PRECOMPUTE_TIMES = (datetime.time(0, 5), datetime.time(8, 0))
+# Через сколько секунд без изменений данных отчёты строятся заново
+ANALYTICS_QUIET_PERIOD = 120
+# Как часто проверять, что данные не меняются, секунды
+ANALYTICS_QUIET_CHECK_INTERVAL = 60
+# Сколько секунд заранее построенный отчёт считается актуальным (до изменения данных)
+ANALYTICS_PRECOMPUTE_TTL = 3600
+
+# Кэши данных, которые читаются почти в каждом обновлении и редко меняются.
+# Кэши используются только из цикла событий бота, поэтому блокировки не нужны.
+# Каждый, кто меняет соответствующие таблицы, обязан явно сбросить кэш.
+
+
+# Кэш "Telegram ID -> сотрудник": (employee_id, name, active) или None,
+# если к Telegram ID никто не привязан (отрицательный результат тоже кэшируется)
+class IdentityCache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Увеличивается при каждом сбросе, чтобы не сохранить результат запроса,
+        # начатого до изменения данных
+        self._generation = 0
+
+    async def get(self, telegram_id):
+        if telegram_id in self._entries:
+            self._entries.move_to_end(telegram_id)
+            return self._entries[telegram_id]
+
+        generation = self._generation
+        identity = await database.run_read(queries.get_employee_identity, telegram_id)
+
+        if generation == self._generation:
+            self._entries[telegram_id] = identity
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return identity
+
+    # Сброс записи для одного Telegram ID
+    def invalidate(self, telegram_id):
+        self._generation += 1
+        self._entries.pop(telegram_id, None)
+
+    # Сброс записей, относящихся к сотруднику (изменение имени, деактивация)
+    def invalidate_employee(self, employee_id):
+        self._generation += 1
+        for telegram_id, identity in list(self._entries.items()):
+            if identity and identity[0] == employee_id:
+                del self._entries[telegram_id]
+
+    # Полный сброс кэша
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+
+# Справочник задач с готовой клавиатурой выбора задачи ("--- категория ---" и
+# "название (N очков) - ID: x") и словарём "текст кнопки -> ID задачи".
+# Любое изменение таблицы tasks должно вызывать invalidate(), которое увеличивает версию;
+# при следующем обращении справочник и клавиатура строятся заново.
+class TaskCatalog:
+    def __init__(self):
+        self.version = 0
+        self._loaded_version = None
+        self._tasks = []
+        self._keyboard = None
+        self._lookup = {}
+
+    async def _ensure_loaded(self):
+        if self._loaded_version == self.version:
+            return
+
+        version = self.version
+        tasks = await database.run_read(queries.get_tasks)
+
+        keyboard = []
+        lookup = {}
+        current_category = None
+
+        for task_id, task_name, points, category in tasks:
+            if category != current_category:
+                if keyboard:
+                    keyboard.append([])
+                current_category = category
+                keyboard.append([f"--- {category} ---"])
+
+            button = f"{task_name} ({points} очков) - ID: {task_id}"
+            keyboard.append([button])
+            lookup[button] = task_id
+
+        keyboard.append(["🔙 Назад"])
+
+        self._tasks = tasks
+        self._keyboard = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        self._lookup = lookup
+        # Если справочник изменился во время загрузки, версия уже другая
+        # и при следующем обращении он будет перестроен
+        self._loaded_version = version
+
+    # Список задач (id, name, points, category) и клавиатура для выбора задачи
+    async def get(self):
+        await self._ensure_loaded()
+        return self._tasks, self._keyboard
+
+    # ID задачи по тексту кнопки или None
+    async def find(self, text):
+        await self._ensure_loaded()
+        return self._lookup.get(text)
+
+    def invalidate(self):
+        self.version += 1
+
+
+# Готовые отчёты аналитики: ключ (тип отчёта, период, show_all) -> результат построения.
+# Запись живёт ttl секунд и сбрасывается invalidate() при любом изменении
+# completed_tasks, employees или tasks. Одновременные запросы одного отчёта
+# ждут одно общее построение, а не запускают каждый свой запрос к базе.
+class AnalyticsCache:
+    def __init__(self, ttl=ANALYTICS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._pending = {}
+        self._generation = 0
+        self._changed_at = time.monotonic()
+
+    # Результат для ключа; build - корутинная функция без аргументов, строящая отчёт.
+    # ttl - сколько секунд хранить построенный отчёт (по умолчанию self.ttl)
+    async def get(self, key, build, ttl=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._build(key, build, ttl or self.ttl))
+            self._pending[key] = pending
+        # Отмена одного ожидающего обработчика не должна отменять построение для остальных
+        return await asyncio.shield(pending)
+
+    async def _build(self, key, build, ttl):
+        generation = self._generation
+        try:
+            value = await build()
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+
+        # Данные изменились во время построения - результат не сохраняем
+        if generation == self._generation:
+            now = time.monotonic()
+            for stale_key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[stale_key]
+            self._entries[key] = (now + ttl, value)
+        return value
+
+    # Построение отчёта заранее: сохранённый отчёт заменяется новым, даже если ещё актуален
+    async def warm(self, key, build, ttl=None):
+        self._entries.pop(key, None)
+        return await self.get(key, build, ttl)
+
+    # Есть ли актуальный отчёт для ключа
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    # Сколько секунд прошло с последнего изменения данных (сброса кэша)
+    def idle_seconds(self):
+        return time.monotonic() - self._changed_at
+
+    # Сброс всех отчётов; построения, начатые до сброса, не сохранятся
+    # и не будут отданы новым запросам
+    def invalidate(self):
+        self._generation += 1
+        self._changed_at = time.monotonic()
+        self._entries.clear()
+        self._pending.clear()
+
+
+identities = IdentityCache()
+tasks = TaskCatalog()
+analytics = AnalyticsCache()
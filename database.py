@@ -0,0 +1,361 @@
+import asyncio
+import calendar
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу базы данных
+DB_PATH = 'shoeshop.db'
+
+# Архивная база для старых выполненных задач. Подключается к каждому соединению
+# как схема archive; представление all_completed_tasks объединяет обе таблицы.
+ARCHIVE_DB_PATH = 'shoeshop_archive.db'
+
+# Выполненные задачи старше этого числа дней переносятся в архивную базу; None - не переносить
+ARCHIVE_AFTER_DAYS = 180
+
+# Как часто запускать перенос в архив, секунды
+ARCHIVE_INTERVAL = 24 * 3600
+
+# Наименьшая поддерживаемая версия SQLite: нужны RETURNING и ON CONFLICT DO UPDATE
+# без указания столбцов конфликта (3.35)
+SQLITE_MIN_VERSION = (3, 35, 0)
+
+# Количество потоков для запросов на чтение
+DB_READ_WORKERS = 4
+
+# Настройки SQLite, применяемые к каждому соединению
+DB_CACHE_SIZE_KB = 16384        # размер кэша страниц на соединение, КБ
+DB_MMAP_SIZE = 256 * 1024 ** 2  # объём файла, читаемый через mmap, байт
+DB_BUSY_TIMEOUT_MS = 5000       # ожидание блокировки перед ошибкой "database is locked", мс
+DB_JOURNAL_SIZE_LIMIT = 64 * 1024 ** 2  # размер WAL-файла, до которого он усекается после checkpoint, байт
+
+# Как часто переносить WAL в основной файл базы, секунды
+WAL_CHECKPOINT_INTERVAL = 300
+
+# Сколько ожидающих изменений поток записи объединяет в одну транзакцию
+WRITE_BATCH_MAX = 64
+
+# Соединения живут всё время работы бота: одно на поток, который обращается к базе
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Чтение выполняется в пуле потоков, запись - в одном отдельном потоке,
+# чтобы SQLite не блокировал цикл событий бота
+_read_executor = None
+_write_queue = queue.Queue()
+_writer_thread = None
+# Ошибка, из-за которой поток записи не смог начать работу (например, не открылась база)
+_writer_error = None
+
+# Сигнал остановки для потока записи
+_STOP = object()
+
+
+# Время в базе хранится целым числом секунд от 1970-01-01 по местным часам магазина
+# (как если бы местное время было UTC). Так сравнения периодов и группировки остаются
+# целочисленными, а день недели и дату можно получить в SQL через 'unixepoch' без 'localtime'.
+_EPOCH = datetime(1970, 1, 1)
+
+
+# Перевод datetime (местное время) в целочисленную метку времени
+def to_timestamp(dt):
+    return calendar.timegm(dt.timetuple())
+
+
+# Перевод целочисленной метки времени обратно в datetime (местное время)
+def from_timestamp(timestamp):
+    return _EPOCH + timedelta(seconds=timestamp)
+
+
+# Текущее время в формате базы
+def now_timestamp():
+    return to_timestamp(datetime.now())
+
+
+# Открытие нового соединения с базой данных
+def _open_connection():
+    if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        required = ".".join(map(str, SQLITE_MIN_VERSION))
+        raise RuntimeError(f"Нужен SQLite {required} или новее, установлен {sqlite3.sqlite_version}")
+
+    # Транзакциями управляем явно (см. _run_in_transaction)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    conn.execute(f"PRAGMA archive.cache_size = -{int(DB_CACHE_SIZE_KB)}")
+    # Все выполненные задачи: горячая таблица и архив (таблицы создаются миграциями,
+    # представление проверяется только при использовании)
+    conn.execute("""
+        CREATE TEMP VIEW all_completed_tasks AS
+        SELECT id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds, weekday
+        FROM main.completed_tasks
+        UNION ALL
+        SELECT id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds, weekday
+        FROM archive.completed_tasks
+    """)
+    return conn
+
+
+# Включение WAL: чтение аналитики и запись задач перестают блокировать друг друга.
+# Режим журнала сохраняется в файле базы, поэтому достаточно выполнить это один раз при запуске.
+# Если WAL включить не удалось, для каждой такой базы записывается предупреждение.
+def enable_wal(conn):
+    for schema in ('main', 'archive'):
+        journal_mode = conn.execute(f"PRAGMA {schema}.journal_mode = WAL").fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            logger.warning(f"Не удалось включить WAL для {schema}, используется режим журнала {journal_mode}")
+        conn.execute(f"PRAGMA {schema}.journal_size_limit = {int(DB_JOURNAL_SIZE_LIMIT)}")
+
+
+# Получение долгоживущего соединения для текущего потока
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+# Закрытие всех открытых соединений (вызывается при остановке бота)
+def close_connections():
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось закрыть соединение с базой данных: {e}")
+
+    _local.__dict__.pop('conn', None)
+
+
+# Выполнение функции на соединении текущего потока без транзакции
+def _run(func, args):
+    return func(get_connection(), *args)
+
+
+# Перенос WAL в основной файл базы. Режим PASSIVE не ждёт читателей (TRUNCATE ждал бы
+# их до DB_BUSY_TIMEOUT_MS, задерживая все изменения в потоке записи): страницы,
+# которые ещё читаются, перенесутся при следующем checkpoint. Размер WAL-файла
+# ограничивает journal_size_limit - файл усекается, когда WAL начинается заново.
+def _checkpoint(conn):
+    busy, log_pages, checkpointed_pages = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if checkpointed_pages < log_pages:
+        logger.info("Checkpoint WAL выполнен не полностью: база занята читателями")
+    return log_pages, checkpointed_pages
+
+
+# Выполнение группы изменений одной транзакцией (group commit).
+# Каждое изменение выполняется в своей точке сохранения: ошибка в одном из них
+# откатывает только его и передаётся ожидающему обработчику, остальные фиксируются
+# общим COMMIT. Результаты отдаются только после успешной фиксации.
+def _commit_batch(conn, batch):
+    results = []
+    # Транзакция могла остаться открытой после неудачного отката предыдущей пачки
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for future, func, args in batch:
+            conn.execute("SAVEPOINT write_op")
+            try:
+                result = func(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_op")
+                conn.execute("RELEASE write_op")
+                results.append((future, None, e))
+            else:
+                conn.execute("RELEASE write_op")
+                results.append((future, result, None))
+        conn.execute("COMMIT")
+    except Exception as e:
+        logger.error(f"Не удалось зафиксировать пачку изменений: {e}")
+        # Откат тоже может не удаться (например, при ошибке ввода-вывода) - ожидающие
+        # изменения всё равно должны получить ошибку
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error as rollback_error:
+            logger.error(f"Не удалось откатить пачку изменений: {rollback_error}")
+        for future, func, args in batch:
+            future.set_exception(e)
+        return
+
+    for future, result, error in results:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+# Выполнение операции вне транзакции (например, checkpoint WAL)
+def _run_outside_transaction(conn, future, func, args):
+    try:
+        future.set_result(func(conn, *args))
+    except Exception as e:
+        future.set_exception(e)
+
+
+# Передача ошибки всем ещё не завершённым операциям
+def _fail_pending(pending, error):
+    for future, func, args, transactional in pending:
+        if not future.done():
+            future.set_exception(error)
+
+
+# Завершение с ошибкой всех операций, ожидающих в очереди потока записи
+def _fail_queued(error):
+    pending = []
+    while True:
+        try:
+            item = _write_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP:
+            pending.append(item)
+    _fail_pending(pending, error)
+
+
+# Выполнение накопившихся операций: транзакционные объединяются в пачки,
+# остальные выполняются между пачками
+def _process_pending(conn, pending):
+    batch = []
+    for future, func, args, transactional in pending:
+        if not future.set_running_or_notify_cancel():
+            continue
+        if transactional:
+            batch.append((future, func, args))
+            continue
+        if batch:
+            _commit_batch(conn, batch)
+            batch = []
+        _run_outside_transaction(conn, future, func, args)
+
+    if batch:
+        _commit_batch(conn, batch)
+
+
+# Основной цикл потока записи: забирает из очереди все накопившиеся изменения
+# и фиксирует их одним COMMIT, так что при пиковой нагрузке fsync выполняется
+# один раз на пачку, а не на каждое нажатие кнопки.
+# Поток не должен завершаться из-за ошибки: иначе ожидающие его обработчики
+# зависнут навсегда. Неожиданная ошибка передаётся операциям текущей пачки.
+def _writer_loop():
+    global _writer_error
+
+    try:
+        conn = get_connection()
+    except Exception as e:
+        logger.error(f"Поток записи не смог открыть базу данных: {e}")
+        _writer_error = e
+        _fail_queued(e)
+        return
+
+    stopping = False
+
+    while not stopping:
+        item = _write_queue.get()
+        if item is _STOP:
+            break
+
+        pending = [item]
+        while len(pending) < WRITE_BATCH_MAX:
+            try:
+                item = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            pending.append(item)
+
+        try:
+            _process_pending(conn, pending)
+        except Exception as e:
+            logger.error(f"Ошибка в потоке записи: {e}")
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error as rollback_error:
+                logger.error(f"Не удалось откатить изменения: {rollback_error}")
+            _fail_pending(pending, e)
+
+
+# Постановка операции в очередь потока записи
+def _submit_write(func, args, transactional):
+    if _writer_thread is None:
+        raise RuntimeError("Поток записи базы данных не запущен (см. database.start)")
+    if _writer_error is not None or not _writer_thread.is_alive():
+        raise RuntimeError(f"Поток записи базы данных остановлен из-за ошибки: {_writer_error}")
+    future = Future()
+    _write_queue.put((future, func, args, transactional))
+    # Поток записи мог остановиться после проверки выше и уже не заберёт операцию
+    if _writer_error is not None:
+        _fail_queued(RuntimeError(f"Поток записи базы данных остановлен из-за ошибки: {_writer_error}"))
+    return future
+
+
+# Запуск пула потоков чтения и потока записи
+def start():
+    global _read_executor, _writer_thread
+
+    if _read_executor is None:
+        _read_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix='db-read')
+    if _writer_thread is None:
+        _writer_thread = threading.Thread(target=_writer_loop, name='db-write', daemon=True)
+        _writer_thread.start()
+
+
+# Остановка потоков (поток записи сначала дописывает очередь) и закрытие соединений
+def shutdown():
+    global _read_executor, _writer_thread, _writer_error
+
+    if _writer_thread is not None and _writer_thread.is_alive():
+        _write_queue.put(_STOP)
+        _writer_thread.join()
+    # Если поток записи остановился из-за ошибки, в очереди могли остаться операции
+    _fail_queued(RuntimeError("Поток записи базы данных остановлен"))
+    _writer_thread = None
+    _writer_error = None
+
+    if _read_executor is not None:
+        _read_executor.shutdown(wait=True)
+    _read_executor = None
+
+    close_connections()
+
+
+# Асинхронное выполнение запроса на чтение: func(conn, *args)
+async def run_read(func, *args):
+    # Без пула run_in_executor молча выполнил бы запрос в пуле цикла событий
+    if _read_executor is None:
+        raise RuntimeError("Пул потоков чтения базы данных не запущен (см. database.start)")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, _run, func, args)
+
+
+# Асинхронное выполнение изменений в потоке записи: func(conn, *args).
+# Изменения атомарны по отдельности, но могут фиксироваться вместе с соседними.
+async def run_write(func, *args):
+    return await asyncio.wrap_future(_submit_write(func, args, True))
+
+
+# Асинхронный checkpoint WAL в потоке записи, чтобы не конкурировать с другими изменениями
+async def checkpoint():
+    return await asyncio.wrap_future(_submit_write(_checkpoint, (), False))
@@ -0,0 +1,101 @@
+import csv
+import gzip
+import heapq
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка выполненных задач в CSV.
+# Строки читаются курсором и сразу пишутся в файл, поэтому память не зависит
+# от количества строк. Функции принимают соединение первым аргументом
+# и вызываются через database.run_read, чтобы не блокировать цикл событий.
+
+# Разделитель столбцов (точка с запятой - для Excel с русской локалью)
+EXPORT_CSV_DELIMITER = ';'
+
+# Наибольший размер файла, который бот может отправить в Telegram (50 МБ)
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+
+EXPORT_COLUMNS = [
+    "id",
+    "employee_id",
+    "employee_name",
+    "task_id",
+    "task_name",
+    "category",
+    "start_time",
+    "end_time",
+    "points_earned",
+    "duration_minutes",
+]
+
+
+# Выполненные задачи таблицы table за период [start_date, end_date) с именами
+# сотрудников и задач. Время выводится строкой в местном времени магазина (см. database.to_timestamp).
+def _iter_table(conn, table, start_date, end_date=None):
+    query = f"""
+        SELECT
+            c.id,
+            c.employee_id,
+            e.name,
+            c.task_id,
+            t.name,
+            t.category,
+            strftime('%Y-%m-%d %H:%M:%S', c.start_time, 'unixepoch'),
+            strftime('%Y-%m-%d %H:%M:%S', c.end_time, 'unixepoch'),
+            c.points_earned,
+            round(c.duration_seconds / 60.0, 2)
+        FROM {table} c
+        LEFT JOIN employees e ON c.employee_id = e.id
+        LEFT JOIN tasks t ON c.task_id = t.id
+        WHERE c.end_time >= ?
+    """
+    params = [start_date]
+    if end_date is not None:
+        query += " AND c.end_time < ?"
+        params.append(end_date)
+    query += " ORDER BY c.end_time, c.id"
+
+    return conn.execute(query, params)
+
+
+# Выполненные задачи за период из горячей таблицы и архива в порядке (end_time, id).
+# Оба курсора уже упорядочены, поэтому слияние идёт потоково. Строка времени
+# 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' сортируется так же, как метка времени.
+def _iter_completed_tasks(conn, start_date, end_date=None):
+    return heapq.merge(
+        _iter_table(conn, "archive.completed_tasks", start_date, end_date),
+        _iter_table(conn, "completed_tasks", start_date, end_date),
+        key=lambda row: (row[7], row[0]),
+    )
+
+
+# Запись выполненных задач за период во временный файл CSV (gzip, если compress).
+# Возвращает (путь к файлу, количество строк); файл удаляет вызывающий.
+def write_completed_tasks_csv(conn, start_date, end_date=None, compress=False):
+    suffix = ".csv.gz" if compress else ".csv"
+    fd, path = tempfile.mkstemp(prefix="completed_tasks_", suffix=suffix)
+    os.close(fd)
+
+    rows = 0
+    try:
+        # utf-8-sig - чтобы Excel правильно определил кодировку
+        if compress:
+            output = gzip.open(path, 'wt', encoding='utf-8-sig', newline='')
+        else:
+            output = open(path, 'w', encoding='utf-8-sig', newline='')
+
+        with output:
+            writer = csv.writer(output, delimiter=EXPORT_CSV_DELIMITER)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in _iter_completed_tasks(conn, start_date, end_date):
+                writer.writerow(row)
+                rows += 1
+    except BaseException:
+        os.remove(path)
+        raise
+
+    logger.info(f"Выгружено выполненных задач: {rows} ({path})")
+    return path, rows
@@ -1,8 +1,18 @@
 import logging
-import sqlite3
+import os
+import analytics_columnar
+import analytics_engine
+import analytics_render
+import cache
+import database
+import export
+import migrations
+import notifications
+import persistence
+import queries
+import update_processor
 from datetime import datetime, timedelta
-from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import PicklePersistence
+from telegram import InputFile, Update, ReplyKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, ContextTypes
 
 # Настройка логирования
@@ -15,6 +25,37 @@ logger = logging.getLogger(__name__)
 # ID администраторов (замените на реальные ID)
 ADMIN_IDS = [1008609216, 801300839]
 
+# Сколько задач сотрудник может выполнять одновременно
+MAX_ACTIVE_TASKS = 3
+
+# Получение обновлений: False - опрос Telegram (run_polling), True - webhook
+# со встроенным HTTP-сервером (обычно за обратным прокси)
+USE_WEBHOOK = False
+# Адрес и порт, на которых слушает встроенный HTTP-сервер, и путь запроса webhook
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "telegram"
+# Внешний адрес webhook, который регистрируется в Telegram (адрес обратного прокси),
+# например https://bot.example.com/telegram
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: запросы без него отклоняются
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN")
+# Сколько одновременных соединений Telegram открывает к webhook
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Сколько полученных, но ещё не обработанных обновлений (ждущих и обрабатываемых)
+# может быть у бота. Когда их столько, приём новых обновлений (ответ на запрос
+# webhook или следующий опрос) ждёт, пока обработка какого-нибудь не завершится
+UPDATE_QUEUE_SIZE = 1000
+
+# Количество выполненных задач на одной странице истории
+HISTORY_PAGE_SIZE = 20
+
+# Отчёты аналитики, которые строятся заранее (см. precompute_analytics):
+# периоды (кнопки выбора периода) и отчёты (тип, показывать всех сотрудников)
+ANALYTICS_PRECOMPUTE_PERIODS = ["За сегодня", "За неделю", "За месяц"]
+ANALYTICS_PRECOMPUTE_REPORTS = [("employees", False), ("employees", True), ("tasks", False), ("general", False)]
+
 # Состояния для ConversationHandler
 (
     MAIN_MENU,
@@ -41,69 +82,28 @@ ADMIN_IDS = [1008609216, 801300839]
     EDIT_TASK_POINTS,
     EDIT_TASK_CATEGORY,
     SELECT_ACTIVE_TASK_CANCEL,
-    VIEW_TASK_HISTORY
+    VIEW_TASK_HISTORY,
+    TASK_HISTORY_PAGE,
+    TASK_HISTORY_PERIOD,
+    TASK_HISTORY_TASK,
+    EXPORT_PERIOD,
+    EXPORT_FORMAT,
+    BROADCAST_TEXT,
+    BROADCAST_CONFIRM
 
-) = range(25)
+) = range(32)
 
-# Инициализация базы данных
+# Инициализация базы данных: создание и обновление схемы
 def init_db():
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    
-    # Таблица сотрудников
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS employees (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        salary REAL NOT NULL,
-        telegram_id INTEGER UNIQUE,
-        active BOOLEAN DEFAULT 1
-    )
-    ''')
-    
-    # Таблица задач
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        points INTEGER NOT NULL,
-        category TEXT NOT NULL
-    )
-    ''')
-    
-    # Таблица активных задач
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS active_tasks (
-        id INTEGER PRIMARY KEY,
-        employee_id INTEGER NOT NULL,
-        task_id INTEGER NOT NULL,
-        start_time TEXT NOT NULL,
-        FOREIGN KEY (employee_id) REFERENCES employees (id),
-        FOREIGN KEY (task_id) REFERENCES tasks (id)
-    )
-    ''')
-    
-    # Таблица выполненных задач
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS completed_tasks (
-        id INTEGER PRIMARY KEY,
-        employee_id INTEGER NOT NULL,
-        task_id INTEGER NOT NULL,
-        start_time TEXT NOT NULL,
-        end_time TEXT NOT NULL,
-        points_earned INTEGER NOT NULL,
-        duration_seconds REAL NOT NULL,
-        FOREIGN KEY (employee_id) REFERENCES employees (id),
-        FOREIGN KEY (task_id) REFERENCES tasks (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    conn = database.get_connection()
+    database.enable_wal(conn)
+    migrations.migrate(conn)
+    # Состояние бота раньше хранилось в файле PicklePersistence - переносим его в базу
+    persistence.import_pickle(conn)
 
 # Заполнение начальными данными
 def fill_initial_data():
-    conn = sqlite3.connect('shoeshop.db')
+    conn = database.get_connection()
     cursor = conn.cursor()
     
     # Проверяем, есть ли уже задачи в базе
@@ -123,36 +123,35 @@ def fill_initial_data():
             ("Уборка торгового зала", 7, "Другое")
         ]
         
+        conn.execute("BEGIN")
         cursor.executemany(
             "INSERT INTO tasks (name, points, category) VALUES (?, ?, ?)",
             tasks
         )
-        
-        conn.commit()
-    
-    conn.close()
+        conn.execute("COMMIT")
 
 # Проверка, является ли пользователь администратором
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
 # Проверка, зарегистрирован ли пользователь как сотрудник
-def is_employee_registered(user_id):
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM employees WHERE telegram_id = ? AND active = 1", (user_id,))
-    result = cursor.fetchone() is not None
-    conn.close()
-    return result
+async def is_employee_registered(user_id):
+    return await get_employee_id(user_id) is not None
 
 # Получение ID сотрудника по Telegram ID
-def get_employee_id(user_id):
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM employees WHERE telegram_id = ? AND active = 1", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+async def get_employee_id(user_id):
+    identity = await cache.identities.get(user_id)
+    if identity and identity[2]:
+        return identity[0]
+    return None
+
+# Определение ID задачи по тексту кнопки из списка задач
+async def parse_task_id(text):
+    task_id = await cache.tasks.find(text)
+    if task_id is None:
+        # Кнопка из устаревшей клавиатуры - берём ID из текста
+        task_id = int(text.split("ID: ")[1])
+    return task_id
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -168,7 +167,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if is_admin(user_id):
         keyboard.append(["👨‍💼 Меню администратора"])
     
-    if is_employee_registered(user_id):
+    if await is_employee_registered(user_id):
         keyboard.append(["👷 Меню сотрудника"])
     else:
         await update.message.reply_text(
@@ -192,13 +191,14 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
         return ADMIN_MENU
     
-    elif text == "👷 Меню сотрудника" and is_employee_registered(user_id):
+    elif text == "👷 Меню сотрудника" and await is_employee_registered(user_id):
         keyboard = [
             ["📝 Взять задачу", "✅ Завершить задачу"],
             ["📈 Моя статистика", "🔙 Назад"]
@@ -233,12 +233,38 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Выберите период для анализа:", reply_markup=reply_markup)
         return SELECT_PERIOD
     
+    elif text == "📤 Экспорт":
+        keyboard = [
+            ["За сегодня", "За неделю"],
+            ["За месяц", "За всё время"],
+            ["🔙 Назад"]
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Выберите период для выгрузки выполненных задач:", reply_markup=reply_markup)
+        return EXPORT_PERIOD
+    
+    elif text == "📣 Рассылка":
+        recipients = await database.run_read(queries.count_broadcast_recipients)
+        last_broadcast = await database.run_read(queries.get_last_broadcast)
+        
+        message = f"📣 Рассылка всем активным сотрудникам с привязанным Telegram ({recipients}).\n"
+        if last_broadcast:
+            broadcast_id, created_at, total, sent, failed = last_broadcast
+            status = "завершена" if sent + failed == total else "отправляется"
+            message += (
+                f"\nПоследняя рассылка #{broadcast_id} от "
+                f"{database.from_timestamp(created_at).strftime('%d.%m.%Y %H:%M')} ({status}): "
+                f"доставлено {sent} из {total}, не доставлено {failed}.\n"
+            )
+        message += "\nВведите текст сообщения:"
+        
+        keyboard = [["🔙 Назад"]]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text(message, reply_markup=reply_markup)
+        return BROADCAST_TEXT
+    
     elif text == "📝 Назначить задачу":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees)
         
         if not employees:
             await update.message.reply_text("Нет активных сотрудников.")
@@ -255,11 +281,7 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECT_EMPLOYEE
     
     elif text == "✏️ Изменить сотрудника":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, salary FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees_with_salary)
         
         if not employees:
             await update.message.reply_text("Нет активных сотрудников.")
@@ -276,51 +298,19 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECT_EMPLOYEE_EDIT
     
     elif text == "✏️ Изменить задачу":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
-        tasks = cursor.fetchall()
-        conn.close()
+        tasks, reply_markup = await cache.tasks.get()
         
         if not tasks:
             await update.message.reply_text("Нет доступных задач.")
             return ADMIN_MENU
         
-        keyboard = []
-        current_category = None
-        
-        for task in tasks:
-            task_id, task_name, points, category = task
-            
-            if category != current_category:
-                if keyboard:
-                    keyboard.append([])
-                current_category = category
-                keyboard.append([f"--- {category} ---"])
-            
-            keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-        
-        keyboard.append(["🔙 Назад"])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
         await update.message.reply_text("Выберите задачу для редактирования:", reply_markup=reply_markup)
         return SELECT_TASK_EDIT
     
     elif text == "❌ Отменить активную задачу":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Получаем все активные задачи
-        cursor.execute("""
-            SELECT a.id, e.name as employee_name, t.name as task_name, a.start_time
-            FROM active_tasks a
-            JOIN employees e ON a.employee_id = e.id
-            JOIN tasks t ON a.task_id = t.id
-            ORDER BY a.start_time
-        """)
-        
-        active_tasks = cursor.fetchall()
-        conn.close()
+        active_tasks = await database.run_read(queries.get_all_active_tasks)
         
         if not active_tasks:
             await update.message.reply_text("Нет активных задач.")
@@ -328,8 +318,7 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         keyboard = []
         for task_id, employee_name, task_name, start_time in active_tasks:
-            start_datetime = datetime.fromisoformat(start_time)
-            duration = (datetime.now() - start_datetime).total_seconds() / 60.0
+            duration = (database.now_timestamp() - start_time) / 60.0
             
             keyboard.append([f"{employee_name}: {task_name} ({round(duration, 2)} мин.) - ID: {task_id}"])
         
@@ -340,11 +329,7 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECT_ACTIVE_TASK_CANCEL
     
     elif text == "📋 История задач":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees)
         
         if not employees:
             await update.message.reply_text("Нет активных сотрудников.")
@@ -367,7 +352,7 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if is_admin(user_id):
             keyboard.append(["👨‍💼 Меню администратора"])
         
-        if is_employee_registered(user_id):
+        if await is_employee_registered(user_id):
             keyboard.append(["👷 Меню сотрудника"])
         
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -382,68 +367,32 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     user_id = update.effective_user.id
-    employee_id = get_employee_id(user_id)
+    employee_id = await get_employee_id(user_id)
     
     if text == "📝 Взять задачу":
         # Проверяем, сколько активных задач у сотрудника
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM active_tasks WHERE employee_id = ?", (employee_id,))
-        active_count = cursor.fetchone()[0]
+        active_count = await database.run_read(queries.count_active_tasks, employee_id)
         
-        if active_count >= 3:
-            conn.close()
+        if active_count >= MAX_ACTIVE_TASKS:
             await update.message.reply_text(
-                "У вас уже есть 3 активные задачи. Завершите хотя бы одну, прежде чем брать новую."
+                f"У вас уже есть {MAX_ACTIVE_TASKS} активные задачи. Завершите хотя бы одну, прежде чем брать новую."
             )
             return EMPLOYEE_MENU
         
         # Получаем список доступных задач
-        cursor.execute("""
-            SELECT t.id, t.name, t.points, t.category
-            FROM tasks t
-            ORDER BY t.category, t.name
-        """)
-        tasks = cursor.fetchall()
-        conn.close()
+        tasks, reply_markup = await cache.tasks.get()
         
         if not tasks:
             await update.message.reply_text("Нет доступных задач.")
             return EMPLOYEE_MENU
         
-        keyboard = []
-        current_category = None
-        
-        for task in tasks:
-            task_id, task_name, points, category = task
-            
-            if category != current_category:
-                if keyboard:
-                    keyboard.append([])
-                current_category = category
-                keyboard.append([f"--- {category} ---"])
-            
-            keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-        
-        keyboard.append(["🔙 Назад"])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
         await update.message.reply_text("Выберите задачу:", reply_markup=reply_markup)
         return TAKE_TASK
     
     elif text == "✅ Завершить задачу":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Получаем активные задачи сотрудника
-        cursor.execute("""
-            SELECT a.id, t.name, t.points, a.start_time
-            FROM active_tasks a
-            JOIN tasks t ON a.task_id = t.id
-            WHERE a.employee_id = ?
-        """, (employee_id,))
-        active_tasks = cursor.fetchall()
-        conn.close()
+        active_tasks = await database.run_read(queries.get_employee_active_tasks, employee_id)
         
         if not active_tasks:
             await update.message.reply_text("У вас нет активных задач.")
@@ -452,8 +401,7 @@ async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = []
         for task in active_tasks:
             task_id, task_name, points, start_time = task
-            start_datetime = datetime.fromisoformat(start_time)
-            duration = (datetime.now() - start_datetime).total_seconds() / 60.0  # в минутах
+            duration = (database.now_timestamp() - start_time) / 60.0  # в минутах
             
             keyboard.append([f"{task_name} ({points} очков, {round(duration, 2)} мин.) - ID: {task_id}"])
         
@@ -464,52 +412,11 @@ async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return COMPLETE_TASK
     
     elif text == "📈 Моя статистика":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        # Получаем статистику сотрудника
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_tasks,
-                SUM(points_earned) as total_points,
-                AVG(duration_seconds) / 60.0 as avg_duration,
-                SUM(duration_seconds) / 3600.0 as total_duration
-            FROM completed_tasks
-            WHERE employee_id = ?
-        """, (employee_id,))
-        stats = cursor.fetchone()
-        
-        # Получаем статистику по категориям
-        cursor.execute("""
-            SELECT 
-                t.category,
-                COUNT(*) as category_count,
-                SUM(c.points_earned) as category_points
-            FROM completed_tasks c
-            JOIN tasks t ON c.task_id = t.id
-            WHERE c.employee_id = ?
-            GROUP BY t.category
-            ORDER BY category_points DESC
-        """, (employee_id,))
-        category_stats = cursor.fetchall()
-        
-        # Получаем активные задачи
-        cursor.execute("""
-            SELECT 
-                t.name,
-                t.points,
-                a.start_time
-            FROM active_tasks a
-            JOIN tasks t ON a.task_id = t.id
-            WHERE a.employee_id = ?
-        """, (employee_id,))
-        active_tasks = cursor.fetchall()
-        
-        # Получаем имя сотрудника
-        cursor.execute("SELECT name FROM employees WHERE id = ?", (employee_id,))
-        employee_name = cursor.fetchone()[0]
-        
-        conn.close()
+        # Получаем статистику сотрудника, статистику по категориям, активные задачи, имя
+        # и скетч времени выполнения задач
+        employee_name, stats, category_stats, active_tasks, duration_sketch = await database.run_read(
+            queries.get_employee_statistics, employee_id
+        )
         
         total_tasks, total_points, avg_duration, total_duration = stats
         
@@ -517,7 +424,12 @@ async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         response += f"📝 Всего выполнено задач: {total_tasks or 0}\n"
         response += f"🏆 Всего заработано очков: {total_points or 0}\n"
         response += f"⏱ Среднее время на задачу: {round(avg_duration or 0, 2)} мин.\n"
-        response += f"⌛ Общее время работы: {round(total_duration or 0, 2)} ч.\n\n"
+        response += f"⌛ Общее время работы: {round(total_duration or 0, 2)} ч.\n"
+        if duration_sketch.total:
+            median = duration_sketch.quantile(0.5) / 60.0
+            p90 = duration_sketch.quantile(0.9) / 60.0
+            response += f"⏱ Медиана: {round(median, 2)} мин., p90: {round(p90, 2)} мин.\n"
+        response += "\n"
         
         if category_stats:
             response += "*Статистика по категориям:*\n"
@@ -528,8 +440,7 @@ async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if active_tasks:
             response += "*Активные задачи:*\n"
             for name, points, start_time in active_tasks:
-                start_datetime = datetime.fromisoformat(start_time)
-                duration = (datetime.now() - start_datetime).total_seconds() / 60.0
+                duration = (database.now_timestamp() - start_time) / 60.0
                 response += f"• {name} ({points} очков) - в работе {round(duration, 2)} мин.\n"
         
         await update.message.reply_text(response, parse_mode='Markdown')
@@ -541,7 +452,7 @@ async def employee_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if is_admin(user_id):
             keyboard.append(["👨‍💼 Меню администратора"])
         
-        if is_employee_registered(user_id):
+        if await is_employee_registered(user_id):
             keyboard.append(["👷 Меню сотрудника"])
         
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -566,17 +477,9 @@ async def enter_employee_salary(update: Update, context: ContextTypes.DEFAULT_TY
         salary = float(update.message.text)
         name = context.user_data['employee_name']
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO employees (name, salary, active) VALUES (?, ?, 1)",
-            (name, salary)
-        )
-        
-        employee_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        employee_id = await database.run_write(queries.add_employee, name, salary)
+        cache.identities.clear()
+        cache.analytics.invalidate()
         
         await update.message.reply_text(
             f"✅ Сотрудник {name} успешно добавлен с зарплатой {salary} руб.\n"
@@ -591,6 +494,7 @@ async def enter_employee_salary(update: Update, context: ContextTypes.DEFAULT_TY
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -651,16 +555,9 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, выберите категорию из предложенных вариантов.")
         return ADD_TASK
     
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT INTO tasks (name, points, category) VALUES (?, ?, ?)",
-        (name, points, category)
-    )
-    
-    conn.commit()
-    conn.close()
+    await database.run_write(queries.add_task, name, points, category)
+    cache.tasks.invalidate()
+    cache.analytics.invalidate()
     
     await update.message.reply_text(
         f"✅ Задача '{name}' успешно добавлена.\n"
@@ -674,6 +571,7 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
         ["📝 Назначить задачу", "📊 Аналитика"],
         ["📋 История задач", "❌ Отменить активную задачу"],
+        ["📤 Экспорт", "📣 Рассылка"],
         ["🔙 Назад"]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -684,7 +582,7 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def take_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     user_id = update.effective_user.id
-    employee_id = get_employee_id(user_id)
+    employee_id = await get_employee_id(user_id)
     
     if text == "🔙 Назад":
         keyboard = [
@@ -701,45 +599,38 @@ async def take_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return TAKE_TASK
     
     try:
-        task_id = int(text.split("ID: ")[1])
-        
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
+        task_id = await parse_task_id(text)
         
-        # Получаем информацию о задаче
-        cursor.execute("SELECT name, points FROM tasks WHERE id = ?", (task_id,))
-        task_info = cursor.fetchone()
+        # Добавляем задачу в активные. Существование задачи, повторное взятие и лимит
+        # активных задач проверяются в той же транзакции, что и вставка
+        now = database.now_timestamp()
+        result, task_name, points = await database.run_write(
+            queries.take_task, employee_id, task_id, now, MAX_ACTIVE_TASKS
+        )
         
-        if not task_info:
-            conn.close()
+        if result == queries.TAKE_NOT_FOUND:
             await update.message.reply_text("Задача не найдена.")
             return TAKE_TASK
         
-        task_name, points = task_info
-        
-        # Проверяем, не взята ли уже эта задача этим сотрудником
-        cursor.execute(
-            "SELECT id FROM active_tasks WHERE employee_id = ? AND task_id = ?",
-            (employee_id, task_id)
-        )
-        if cursor.fetchone():
-            conn.close()
+        if result == queries.TAKE_ALREADY_TAKEN:
             await update.message.reply_text("Вы уже взяли эту задачу.")
             return TAKE_TASK
         
-        # Добавляем задачу в активные
-        now = datetime.now().isoformat()
-        cursor.execute(
-            "INSERT INTO active_tasks (employee_id, task_id, start_time) VALUES (?, ?, ?)",
-            (employee_id, task_id, now)
-        )
-        
-        conn.commit()
-        conn.close()
+        if result == queries.TAKE_LIMIT_REACHED:
+            keyboard = [
+                ["📝 Взять задачу", "✅ Завершить задачу"],
+                ["📈 Моя статистика", "🔙 Назад"]
+            ]
+            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            await update.message.reply_text(
+                f"У вас уже есть {MAX_ACTIVE_TASKS} активные задачи. Завершите хотя бы одну, прежде чем брать новую.",
+                reply_markup=reply_markup
+            )
+            return EMPLOYEE_MENU
         
         await update.message.reply_text(
             f"✅ Вы взяли задачу '{task_name}' ({points} очков).\n"
-            f"Время начала: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
+            f"Время начала: {database.from_timestamp(now).strftime('%d.%m.%Y %H:%M:%S')}"
         )
         
         # Возвращаемся в меню сотрудника
@@ -759,7 +650,7 @@ async def take_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def complete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     user_id = update.effective_user.id
-    employee_id = get_employee_id(user_id)
+    employee_id = await get_employee_id(user_id)
     
     if text == "🔙 Назад":
         keyboard = [
@@ -773,50 +664,20 @@ async def complete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         active_task_id = int(text.split("ID: ")[1])
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        # Получаем информацию об активной задаче
-        cursor.execute("""
-            SELECT a.task_id, t.name, t.points, a.start_time
-            FROM active_tasks a
-            JOIN tasks t ON a.task_id = t.id
-            WHERE a.id = ? AND a.employee_id = ?
-        """, (active_task_id, employee_id))
-        
-        task_info = cursor.fetchone()
+        # Переносим задачу из активных в выполненные одной транзакцией
+        end_time = database.now_timestamp()
+        try:
+            task_info = await database.run_write(queries.complete_task, active_task_id, employee_id, end_time)
+        except LookupError:
+            # Задачу удалили из справочника: завершение отменено, активная задача осталась
+            task_info = None
         
         if not task_info:
-            conn.close()
             await update.message.reply_text("Задача не найдена или не принадлежит вам.")
             return COMPLETE_TASK
         
-        task_id, task_name, points, start_time = task_info
-        
-        # Рассчитываем длительность выполнения
-        start_datetime = datetime.fromisoformat(start_time)
-        end_datetime = datetime.now()
-        duration_seconds = (end_datetime - start_datetime).total_seconds()
-        
-        # Добавляем в выполненные задачи
-        cursor.execute("""
-            INSERT INTO completed_tasks 
-            (employee_id, task_id, start_time, end_time, points_earned, duration_seconds)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            employee_id, 
-            task_id, 
-            start_time, 
-            end_datetime.isoformat(), 
-            points, 
-            duration_seconds
-        ))
-        
-        # Удаляем из активных задач
-        cursor.execute("DELETE FROM active_tasks WHERE id = ?", (active_task_id,))
-        
-        conn.commit()
-        conn.close()
+        task_name, points, duration_seconds = task_info
+        cache.analytics.invalidate()
         
         duration_minutes = duration_seconds / 60.0
         
@@ -839,6 +700,21 @@ async def complete_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Не удалось определить ID задачи. Пожалуйста, выберите задачу из списка.")
         return COMPLETE_TASK
 
+# Начало и название периода по кнопке "За сегодня" / "За неделю" / "За месяц" / "За всё время".
+# Для неизвестного текста возвращает (None, None).
+def parse_period(text):
+    now = datetime.now()
+    
+    if text == "За сегодня":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0), "сегодня"
+    elif text == "За неделю":
+        return now - timedelta(days=7), "последнюю неделю"
+    elif text == "За месяц":
+        return now - timedelta(days=30), "последний месяц"
+    elif text == "За всё время":
+        return datetime(2000, 1, 1), "всё время"  # Достаточно давно
+    return None, None
+
 # Обработчик выбора периода для аналитики
 async def select_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
@@ -849,6 +725,7 @@ async def select_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -856,21 +733,9 @@ async def select_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ADMIN_MENU
     
     # Определяем период для аналитики
-    now = datetime.now()
+    start_date, period_name = parse_period(text)
     
-    if text == "За сегодня":
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        period_name = "сегодня"
-    elif text == "За неделю":
-        start_date = now - timedelta(days=7)
-        period_name = "последнюю неделю"
-    elif text == "За месяц":
-        start_date = now - timedelta(days=30)
-        period_name = "последний месяц"
-    elif text == "За всё время":
-        start_date = datetime(2000, 1, 1)  # Достаточно давно
-        period_name = "всё время"
-    else:
+    if start_date is None:
         await update.message.reply_text("Пожалуйста, выберите период из предложенных вариантов.")
         return SELECT_PERIOD
     
@@ -887,6 +752,56 @@ async def select_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"Выберите тип аналитики за {period_name}:", reply_markup=reply_markup)
     return ANALYTICS
 
+# Ключ кэша отчёта аналитики: тип отчёта, период (с датой начала) и режим отображения
+def analytics_cache_key(kind, start_date, period_name, show_all=False):
+    return (kind, period_name, start_date.date(), show_all)
+
+# Отчёт аналитики из кэша; kind - "employees", "tasks" или "general".
+# warm - построить заново и хранить дольше обычного (заранее построенные отчёты)
+async def get_analytics_report(kind, start_date, period_name, show_all=False, warm=False):
+    start = database.to_timestamp(start_date)
+    if kind == "employees":
+        build = lambda: database.run_read(analytics_engine.employee_report, start, None, show_all)
+    elif kind == "tasks":
+        build = lambda: database.run_read(analytics_engine.task_report, start)
+    else:
+        build = lambda: database.run_read(analytics_engine.general_report, start)
+
+    key = analytics_cache_key(kind, start_date, period_name, show_all)
+    if warm:
+        return await cache.analytics.warm(key, build, cache.ANALYTICS_PRECOMPUTE_TTL)
+    return await cache.analytics.get(key, build)
+
+# Отправка отчёта в Markdown несколькими сообщениями не длиннее лимита Telegram.
+# Разделы строятся по мере отправки: первое сообщение уходит до того, как построены остальные.
+# Клавиатура прикрепляется к первому сообщению.
+async def reply_in_chunks(message, sections, reply_markup=None):
+    for text in analytics_render.pack_messages(sections):
+        await message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        reply_markup = None
+
+# Отчёт по сотрудникам с кнопкой переключения "все / только активные"
+async def send_employee_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE, start_date, period_name):
+    # Проверяем, нужно ли показывать всех сотрудников или только активных
+    show_all = context.user_data.get('show_all_employees', False)
+    
+    report = await get_analytics_report("employees", start_date, period_name, show_all)
+    
+    if not report.employees:
+        await update.message.reply_text("Нет данных о сотрудниках.")
+        return ANALYTICS
+    
+    # Добавляем кнопку для переключения режима отображения
+    keyboard = [
+        ["👥 Показать всех" if not show_all else "👥 Только активные"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    
+    sections = analytics_render.employee_report_sections(report, period_name)
+    await reply_in_chunks(update.message, sections, reply_markup)
+    return ANALYTICS
+
 # Обработчик аналитики
 async def analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
@@ -894,247 +809,40 @@ async def analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     period_name = context.user_data['analytics_period_name']
     
     if text == "👥 По сотрудникам":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Получаем статистику по сотрудникам за выбранный период
-        # Проверяем, нужно ли показывать всех сотрудников или только активных
-        show_all = context.user_data.get('show_all_employees', False)
-        
-        query = """
-            SELECT 
-                e.id,
-                e.name,
-                COUNT(c.id) as completed_count,
-                SUM(c.points_earned) as total_points,
-                AVG(c.duration_seconds) / 60.0 as avg_duration,
-                SUM(c.duration_seconds) / 3600.0 as total_hours,
-                e.salary,
-                e.active
-            FROM employees e
-            LEFT JOIN completed_tasks c ON e.id = c.employee_id AND c.end_time >= ?
-        """
-        
-        if not show_all:
-            query += " WHERE e.active = 1"
-        
-        query += " GROUP BY e.id ORDER BY total_points DESC"
-        
-        cursor.execute(query, (start_date.isoformat(),))
-        employees_stats = cursor.fetchall()
-        conn.close()
-        
-        if not employees_stats:
-            await update.message.reply_text("Нет данных о сотрудниках.")
-            return ANALYTICS
-        
-        # Добавляем кнопку для переключения режима отображения
-        keyboard = [
-            ["👥 Показать всех" if not show_all else "👥 Только активные"],
-            ["🔙 Назад"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        
-        response = f"📊 *Аналитика по сотрудникам за {period_name}*\n"
-        if show_all:
-            response += "_(показаны все сотрудники, включая неактивных)_\n\n"
-        else:
-            response += "_(показаны только активные сотрудники)_\n\n"
-        
-        for emp in employees_stats:
-            emp_id, name, completed, points, avg_duration, total_hours, salary, active = emp
-            
-            # Преобразуем None в 0 для безопасных вычислений
-            completed = completed or 0
-            points = points or 0
-            avg_duration = avg_duration or 0
-            total_hours = total_hours or 0
-            
-            # Расчет эффективности (очков в час)
-            # Если времени работы мало, используем среднее время на задачу для расчета
-            if completed > 0 and avg_duration > 0:
-                # Сколько задач можно выполнить за час при текущей скорости
-                tasks_per_hour = 60 / avg_duration
-                # Сколько очков можно заработать за час
-                points_per_hour = round((points / completed) * tasks_per_hour, 2)
-            elif total_hours > 0:
-                # Стандартный расчет, если есть время работы
-                points_per_hour = round(points / total_hours, 2)
-            else:
-                points_per_hour = 0
-            
-            # Расчет стоимости очка (руб/очко)
-            # Используем месячную зарплату и предполагаемое количество очков за месяц
-            if points_per_hour > 0:
-                # Предполагаем 160 рабочих часов в месяц (8 часов * 20 дней)
-                monthly_points_estimate = points_per_hour * 160
-                # Стоимость одного очка
-                salary_per_point = round(salary / monthly_points_estimate, 2)
-            else:
-                salary_per_point = 0
-            
-            status = "✅ Активен" if active else "❌ Неактивен"
-            response += f"*{name}* (ID: {emp_id}) - {status}\n"
-            response += f"📝 Выполнено задач: {completed}\n"
-            response += f"🏆 Всего очков: {points}\n"
-            response += f"⏱ Среднее время на задачу: {round(avg_duration, 2)} мин.\n"
-            response += f"⌛ Общее время работы: {round(total_hours, 2)} ч.\n"
-            response += f"📈 Эффективность: {points_per_hour} очков/час\n"
-            response += f"💰 Стоимость очка: {salary_per_point} руб.\n\n"
-        
-        await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
-        return ANALYTICS
+        return await send_employee_analytics(update, context, start_date, period_name)
     
     elif text == "👥 Показать всех":
         context.user_data['show_all_employees'] = True
-        # Повторно вызываем аналитику по сотрудникам
+        # Повторно показываем аналитику по сотрудникам
         context.user_data['last_analytics_command'] = "👥 По сотрудникам"
-        return await analytics(update, context)
+        return await send_employee_analytics(update, context, start_date, period_name)
     
     elif text == "👥 Только активные":
         context.user_data['show_all_employees'] = False
-        # Повторно вызываем аналитику по сотрудникам
+        # Повторно показываем аналитику по сотрудникам
         context.user_data['last_analytics_command'] = "👥 По сотрудникам"
-        return await analytics(update, context)
+        return await send_employee_analytics(update, context, start_date, period_name)
     elif text == "🎯 По задачам":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Получаем статистику по задачам за выбранный период
-        cursor.execute("""
-            SELECT 
-                t.id,
-                t.name,
-                t.category,
-                COUNT(c.id) as completed_count,
-                AVG(c.duration_seconds) / 60.0 as avg_duration,
-                t.points
-            FROM tasks t
-            LEFT JOIN completed_tasks c ON t.id = c.task_id AND c.end_time >= ?
-            GROUP BY t.id
-            ORDER BY completed_count DESC
-        """, (start_date.isoformat(),))
-        tasks_stats = cursor.fetchall()
-        conn.close()
-        
-        if not tasks_stats:
+        report = await get_analytics_report("tasks", start_date, period_name)
+        
+        if not report.tasks:
             await update.message.reply_text("Нет данных о задачах.")
             return ANALYTICS
         
-        response = f"📊 *Аналитика по задачам за {period_name}*\n\n"
-        
-        current_category = None
-        for task in tasks_stats:
-            task_id, name, category, completed, avg_duration, points = task
-            
-            # Преобразуем None в 0
-            completed = completed or 0
-            avg_duration = avg_duration or 0
-            
-            if category != current_category:
-                response += f"\n*{category}*\n"
-                current_category = category
-            
-            response += f"• {name} ({points} очков)\n"
-            response += f"  Выполнено: {completed} раз\n"
-            response += f"  Среднее время: {round(avg_duration, 2)} мин.\n"
-        
-        await update.message.reply_text(response, parse_mode='Markdown')
+        await reply_in_chunks(update.message, analytics_render.task_report_sections(report, period_name))
         return ANALYTICS
     
     elif text == "📈 Общая статистика":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        # Общая статистика за выбранный период
-        cursor.execute("""
-            SELECT 
-                COUNT(DISTINCT c.employee_id) as active_employees,
-                COUNT(c.id) as total_completed,
-                SUM(c.points_earned) as total_points,
-                AVG(c.duration_seconds) / 60.0 as avg_task_duration,
-                SUM(c.duration_seconds) / 3600.0 as total_hours
-            FROM completed_tasks c
-            JOIN employees e ON c.employee_id = e.id
-            WHERE c.end_time >= ? AND e.active = 1
-        """, (start_date.isoformat(),))
-        general_stats = cursor.fetchone()
-        
-        # Статистика по категориям за выбранный период
-        cursor.execute("""
-            SELECT 
-                t.category,
-                COUNT(c.id) as category_count,
-                SUM(c.points_earned) as category_points,
-                AVG(c.duration_seconds) / 60.0 as category_avg_duration
-            FROM completed_tasks c
-            JOIN tasks t ON c.task_id = t.id
-            JOIN employees e ON c.employee_id = e.id
-            WHERE c.end_time >= ? AND e.active = 1
-            GROUP BY t.category
-            ORDER BY category_points DESC
-        """, (start_date.isoformat(),))
-        category_stats = cursor.fetchall()
-        
-        # Статистика по дням недели за выбранный период
-        cursor.execute("""
-            SELECT 
-                strftime('%w', substr(c.end_time, 1, 10)) as day_of_week,
-                COUNT(c.id) as day_count,
-                SUM(c.points_earned) as day_points
-            FROM completed_tasks c
-            JOIN employees e ON c.employee_id = e.id
-            WHERE c.end_time >= ? AND e.active = 1
-            GROUP BY day_of_week
-            ORDER BY day_of_week
-        """, (start_date.isoformat(),))
-        day_stats = cursor.fetchall()
-        
-        conn.close()
-        
-        if not general_stats[0]:
+        # Общая статистика, статистика по категориям и по дням недели за выбранный период
+        report = await get_analytics_report("general", start_date, period_name)
+        
+        if not report.active_employees:
             await update.message.reply_text(f"Нет данных для анализа за {period_name}.")
             return ANALYTICS
         
-        active_employees, total_completed, total_points, avg_task_duration, total_hours = general_stats
-        
-        # Преобразуем None в 0
-        active_employees = active_employees or 0
-        total_completed = total_completed or 0
-        total_points = total_points or 0
-        avg_task_duration = avg_task_duration or 0
-        total_hours = total_hours or 0
-        
-        response = f"📊 *Общая статистика за {period_name}*\n\n"
-        response += f"👥 Активных сотрудников: {active_employees}\n"
-        response += f"📝 Всего выполнено задач: {total_completed}\n"
-        response += f"🏆 Всего заработано очков: {total_points}\n"
-        response += f"⏱ Среднее время на задачу: {round(avg_task_duration, 2)} мин.\n"
-        response += f"⌛ Общее время работы: {round(total_hours, 2)} ч.\n\n"
-        
-        if category_stats:
-            response += "*Статистика по категориям:*\n"
-            for category, count, points, avg_duration in category_stats:
-                # Преобразуем None в 0
-                count = count or 0
-                points = points or 0
-                avg_duration = avg_duration or 0
-                
-                response += f"• {category}: {count} задач, {points} очков, {round(avg_duration, 2)} мин. в среднем\n"
-            response += "\n"
-        
-        if day_stats:
-            days = ["Воскресенье", "Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота"]
-            response += "*Статистика по дням недели:*\n"
-            for day_num, count, points in day_stats:
-                # Преобразуем None в 0
-                count = count or 0
-                points = points or 0
-                
-                day_name = days[int(day_num)]
-                response += f"• {day_name}: {count} задач, {points} очков\n"
-        
-        await update.message.reply_text(response, parse_mode='Markdown')
+        await reply_in_chunks(update.message, analytics_render.general_report_sections(report, period_name))
         return ANALYTICS
     
     elif text == "🔙 Назад":
@@ -1161,6 +869,7 @@ async def select_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1173,32 +882,12 @@ async def select_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['selected_employee_id'] = employee_id
         context.user_data['selected_employee_name'] = employee_name
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category")
-        tasks = cursor.fetchall()
-        conn.close()
+        tasks, reply_markup = await cache.tasks.get()
         
         if not tasks:
             await update.message.reply_text("Нет доступных задач.")
             return ADMIN_MENU
         
-        keyboard = []
-        current_category = None
-        
-        for task in tasks:
-            task_id, task_name, points, category = task
-            
-            if category != current_category:
-                if keyboard:
-                    keyboard.append([])
-                current_category = category
-                keyboard.append([f"--- {category} ---"])
-            
-            keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-        
-        keyboard.append(["🔙 Назад"])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
         await update.message.reply_text(f"Выберите задачу для сотрудника {employee_name}:", reply_markup=reply_markup)
         return ASSIGN_TASK
@@ -1212,11 +901,7 @@ async def assign_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     
     if text == "🔙 Назад":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees)
         
         keyboard = []
         for emp_id, emp_name in employees:
@@ -1234,59 +919,41 @@ async def assign_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASSIGN_TASK
     
     try:
-        task_id = int(text.split("ID: ")[1])
+        task_id = await parse_task_id(text)
         employee_id = context.user_data['selected_employee_id']
         employee_name = context.user_data['selected_employee_name']
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Получаем информацию о задаче
-        cursor.execute("SELECT name, points FROM tasks WHERE id = ?", (task_id,))
-        task_info = cursor.fetchone()
+        task_info = await database.run_read(queries.get_task, task_id)
         
         if not task_info:
-            conn.close()
             await update.message.reply_text("Задача не найдена.")
             return ASSIGN_TASK
         
         task_name, points = task_info
         
-        # Добавляем задачу в активные для выбранного сотрудника
-        now = datetime.now().isoformat()
-        cursor.execute(
-            "INSERT INTO active_tasks (employee_id, task_id, start_time) VALUES (?, ?, ?)",
-            (employee_id, task_id, now)
+        # Добавляем задачу в активные для выбранного сотрудника; уведомление сотруднику
+        # (если у него есть привязанный аккаунт) ставится в очередь в той же транзакции
+        now = database.now_timestamp()
+        notification = (
+            f"🔔 Вам назначена новая задача: '{task_name}' ({points} очков).\n"
+            f"Время начала: {database.from_timestamp(now).strftime('%d.%m.%Y %H:%M:%S')}"
         )
-        conn.commit()
-        
-        # Получаем telegram_id сотрудника для уведомления
-        cursor.execute("SELECT telegram_id FROM employees WHERE id = ?", (employee_id,))
-        telegram_id = cursor.fetchone()[0]
-        
-        conn.close()
+        telegram_id = await database.run_write(queries.assign_task, employee_id, task_id, now, notification)
+        if telegram_id:
+            notifications.sender.wake()
         
         await update.message.reply_text(
             f"✅ Задача '{task_name}' ({points} очков) успешно назначена сотруднику {employee_name}."
         )
         
-        # Уведомляем сотрудника, если у него есть привязанный аккаунт
-        if telegram_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=f"🔔 Вам назначена новая задача: '{task_name}' ({points} очков).\n"
-                         f"Время начала: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление сотруднику: {e}")
-        
         # Возвращаемся в меню администратора
         keyboard = [
             ["👤 Добавить сотрудника", "📋 Добавить задачу"],
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1307,6 +974,7 @@ async def select_employee_edit(update: Update, context: ContextTypes.DEFAULT_TYP
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1352,15 +1020,10 @@ async def edit_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_EMPLOYEE_SALARY
     
     elif text == "Деактивировать сотрудника":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Проверяем, есть ли у сотрудника активные задачи
-        cursor.execute("SELECT COUNT(*) FROM active_tasks WHERE employee_id = ?", (employee_id,))
-        active_count = cursor.fetchone()[0]
+        active_count = await database.run_read(queries.count_active_tasks, employee_id)
         
         if active_count > 0:
-            conn.close()
             await update.message.reply_text(
                 f"Невозможно деактивировать сотрудника {employee_name}, так как у него есть активные задачи. "
                 f"Сначала отмените все активные задачи."
@@ -1368,9 +1031,9 @@ async def edit_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return EDIT_EMPLOYEE
         
         # Вместо удаления, меняем статус на неактивный
-        cursor.execute("UPDATE employees SET active = 0 WHERE id = ?", (employee_id,))
-        conn.commit()
-        conn.close()
+        await database.run_write(queries.deactivate_employee, employee_id)
+        cache.identities.invalidate_employee(employee_id)
+        cache.analytics.invalidate()
         
         await update.message.reply_text(f"✅ Сотрудник {employee_name} успешно деактивирован.")
         
@@ -1380,6 +1043,7 @@ async def edit_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1387,11 +1051,7 @@ async def edit_employee(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ADMIN_MENU
     
     elif text == "🔙 Назад":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, salary FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees_with_salary)
         
         keyboard = []
         for emp_id, emp_name, emp_salary in employees:
@@ -1413,21 +1073,14 @@ async def edit_employee_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
     employee_id = context.user_data.get('edit_employee_id')
     old_name = context.user_data.get('edit_employee_name')
     
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("UPDATE employees SET name = ? WHERE id = ?", (new_name, employee_id))
-    conn.commit()
-    conn.close()
+    await database.run_write(queries.update_employee_name, employee_id, new_name)
+    cache.identities.invalidate_employee(employee_id)
+    cache.analytics.invalidate()
     
     await update.message.reply_text(f"✅ Имя сотрудника изменено с '{old_name}' на '{new_name}'.")
     
     # Возвращаемся к списку сотрудников
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, salary FROM employees WHERE active = 1 ORDER BY name")
-    employees = cursor.fetchall()
-    conn.close()
+    employees = await database.run_read(queries.get_active_employees_with_salary)
     
     keyboard = []
     for emp_id, emp_name, emp_salary in employees:
@@ -1450,21 +1103,13 @@ async def edit_employee_salary(update: Update, context: ContextTypes.DEFAULT_TYP
             await update.message.reply_text("Зарплата должна быть положительным числом.")
             return EDIT_EMPLOYEE_SALARY
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE employees SET salary = ? WHERE id = ?", (new_salary, employee_id))
-        conn.commit()
-        conn.close()
+        await database.run_write(queries.update_employee_salary, employee_id, new_salary)
+        cache.analytics.invalidate()
         
         await update.message.reply_text(f"✅ Зарплата сотрудника {employee_name} изменена на {new_salary} руб.")
         
         # Возвращаемся к списку сотрудников
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, salary FROM employees WHERE active = 1 ORDER BY name")
-        employees = cursor.fetchall()
-        conn.close()
+        employees = await database.run_read(queries.get_active_employees_with_salary)
         
         keyboard = []
         for emp_id, emp_name, emp_salary in employees:
@@ -1490,6 +1135,7 @@ async def select_task_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1502,7 +1148,7 @@ async def select_task_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SELECT_TASK_EDIT
     
     try:
-        task_id = int(text.split("ID: ")[1])
+        task_id = await parse_task_id(text)
         task_name = text.split(" (")[0]
         
         context.user_data['edit_task_id'] = task_id
@@ -1552,15 +1198,10 @@ async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_TASK_CATEGORY
     
     elif text == "Удалить задачу":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
         # Проверяем, есть ли активные задачи с этой задачей
-        cursor.execute("SELECT COUNT(*) FROM active_tasks WHERE task_id = ?", (task_id,))
-        active_count = cursor.fetchone()[0]
+        active_count = await database.run_read(queries.count_active_tasks_for_task, task_id)
         
         if active_count > 0:
-            conn.close()
             await update.message.reply_text(
                 f"Невозможно удалить задачу '{task_name}', так как она сейчас выполняется. "
                 f"Сначала отмените все активные задачи с этой задачей."
@@ -1568,9 +1209,9 @@ async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return EDIT_TASK
         
         # Удаляем задачу
-        cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-        conn.commit()
-        conn.close()
+        await database.run_write(queries.delete_task, task_id)
+        cache.tasks.invalidate()
+        cache.analytics.invalidate()
         
         await update.message.reply_text(f"✅ Задача '{task_name}' успешно удалена.")
         
@@ -1580,6 +1221,7 @@ async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1587,28 +1229,7 @@ async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ADMIN_MENU
     
     elif text == "🔙 Назад":
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
-        tasks = cursor.fetchall()
-        conn.close()
-        
-        keyboard = []
-        current_category = None
-        
-        for task in tasks:
-            task_id, task_name, points, category = task
-            
-            if category != current_category:
-                if keyboard:
-                    keyboard.append([])
-                current_category = category
-                keyboard.append([f"--- {category} ---"])
-            
-            keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-        
-        keyboard.append(["🔙 Назад"])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        tasks, reply_markup = await cache.tasks.get()
         
         await update.message.reply_text("Выберите задачу для редактирования:", reply_markup=reply_markup)
         return SELECT_TASK_EDIT
@@ -1623,38 +1244,14 @@ async def edit_task_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     task_id = context.user_data.get('edit_task_id')
     old_name = context.user_data.get('edit_task_name')
     
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("UPDATE tasks SET name = ? WHERE id = ?", (new_name, task_id))
-    conn.commit()
-    conn.close()
+    await database.run_write(queries.update_task_name, task_id, new_name)
+    cache.tasks.invalidate()
+    cache.analytics.invalidate()
     
     await update.message.reply_text(f"✅ Название задачи изменено с '{old_name}' на '{new_name}'.")
     
     # Возвращаемся к списку задач
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
-    tasks = cursor.fetchall()
-    conn.close()
-    
-    keyboard = []
-    current_category = None
-    
-    for task in tasks:
-        task_id, task_name, points, category = task
-        
-        if category != current_category:
-            if keyboard:
-                keyboard.append([])
-            current_category = category
-            keyboard.append([f"--- {category} ---"])
-        
-        keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-    
-    keyboard.append(["🔙 Назад"])
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    tasks, reply_markup = await cache.tasks.get()
     
     await update.message.reply_text("Выберите задачу для редактирования:", reply_markup=reply_markup)
     return SELECT_TASK_EDIT
@@ -1670,38 +1267,14 @@ async def edit_task_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Количество очков должно быть положительным числом.")
             return EDIT_TASK_POINTS
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("UPDATE tasks SET points = ? WHERE id = ?", (new_points, task_id))
-        conn.commit()
-        conn.close()
+        await database.run_write(queries.update_task_points, task_id, new_points)
+        cache.tasks.invalidate()
+        cache.analytics.invalidate()
         
         await update.message.reply_text(f"✅ Количество очков для задачи '{task_name}' изменено на {new_points}.")
         
         # Возвращаемся к списку задач
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
-        tasks = cursor.fetchall()
-        conn.close()
-        
-        keyboard = []
-        current_category = None
-        
-        for task in tasks:
-            task_id, task_name, points, category = task
-            
-            if category != current_category:
-                if keyboard:
-                    keyboard.append([])
-                current_category = category
-                keyboard.append([f"--- {category} ---"])
-            
-            keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-        
-        keyboard.append(["🔙 Назад"])
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        tasks, reply_markup = await cache.tasks.get()
         
         await update.message.reply_text("Выберите задачу для редактирования:", reply_markup=reply_markup)
         return SELECT_TASK_EDIT
@@ -1722,38 +1295,14 @@ async def edit_task_category(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Пожалуйста, выберите категорию из предложенных вариантов.")
         return EDIT_TASK_CATEGORY
     
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("UPDATE tasks SET category = ? WHERE id = ?", (new_category, task_id))
-    conn.commit()
-    conn.close()
+    await database.run_write(queries.update_task_category, task_id, new_category)
+    cache.tasks.invalidate()
+    cache.analytics.invalidate()
     
     await update.message.reply_text(f"✅ Категория задачи '{task_name}' изменена на '{new_category}'.")
     
     # Возвращаемся к списку задач
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
-    tasks = cursor.fetchall()
-    conn.close()
-    
-    keyboard = []
-    current_category = None
-    
-    for task in tasks:
-        task_id, task_name, points, category = task
-        
-        if category != current_category:
-            if keyboard:
-                keyboard.append([])
-            current_category = category
-            keyboard.append([f"--- {category} ---"])
-        
-        keyboard.append([f"{task_name} ({points} очков) - ID: {task_id}"])
-    
-    keyboard.append(["🔙 Назад"])
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    tasks, reply_markup = await cache.tasks.get()
     
     await update.message.reply_text("Выберите задачу для редактирования:", reply_markup=reply_markup)
     return SELECT_TASK_EDIT
@@ -1768,6 +1317,7 @@ async def select_active_task_cancel(update: Update, context: ContextTypes.DEFAUL
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1777,60 +1327,27 @@ async def select_active_task_cancel(update: Update, context: ContextTypes.DEFAUL
     try:
         active_task_id = int(text.split("ID: ")[1])
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        # Получаем информацию об активной задаче
-        cursor.execute("""
-            SELECT a.id, e.name as employee_name, t.name as task_name, a.start_time, e.telegram_id
-            FROM active_tasks a
-            JOIN employees e ON a.employee_id = e.id
-            JOIN tasks t ON a.task_id = t.id
-            WHERE a.id = ?
-        """, (active_task_id,))
-        
-        task_info = cursor.fetchone()
+        # Удаляем активную задачу и получаем информацию о ней; уведомление сотруднику
+        # ставится в очередь в той же транзакции
+        task_info = await database.run_write(
+            queries.cancel_active_task, active_task_id,
+            "🔔 Ваша задача '{task_name}' была отменена администратором.", database.now_timestamp()
+        )
         
         if not task_info:
-            conn.close()
             await update.message.reply_text("Задача не найдена.")
             return SELECT_ACTIVE_TASK_CANCEL
         
-        _, employee_name, task_name, start_time, telegram_id = task_info
-        
-        # Удаляем активную задачу
-        cursor.execute("DELETE FROM active_tasks WHERE id = ?", (active_task_id,))
-        conn.commit()
-        conn.close()
+        employee_name, task_name, telegram_id = task_info
+        if telegram_id:
+            notifications.sender.wake()
         
         await update.message.reply_text(
             f"✅ Задача '{task_name}' отменена для сотрудника {employee_name}."
         )
         
-        # Уведомляем сотрудника, если у него есть привязанный аккаунт
-        if telegram_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=f"🔔 Ваша задача '{task_name}' была отменена администратором."
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление сотруднику: {e}")
-        
         # Возвращаемся к списку активных задач
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT a.id, e.name as employee_name, t.name as task_name, a.start_time
-            FROM active_tasks a
-            JOIN employees e ON a.employee_id = e.id
-            JOIN tasks t ON a.task_id = t.id
-            ORDER BY e.name, a.start_time
-        """)
-        
-        active_tasks = cursor.fetchall()
-        conn.close()
+        active_tasks = await database.run_read(queries.get_all_active_tasks)
         
         if not active_tasks:
             await update.message.reply_text("Нет активных задач.")
@@ -1840,6 +1357,7 @@ async def select_active_task_cancel(update: Update, context: ContextTypes.DEFAUL
                 ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
                 ["📝 Назначить задачу", "📊 Аналитика"],
                 ["📋 История задач", "❌ Отменить активную задачу"],
+                ["📤 Экспорт", "📣 Рассылка"],
                 ["🔙 Назад"]
             ]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1851,8 +1369,7 @@ async def select_active_task_cancel(update: Update, context: ContextTypes.DEFAUL
         
         for task in active_tasks:
             task_id, employee_name, task_name, start_time = task
-            start_datetime = datetime.fromisoformat(start_time)
-            duration = (datetime.now() - start_datetime).total_seconds() / 60.0  # в минутах
+            duration = (database.now_timestamp() - start_time) / 60.0  # в минутах
             
             if employee_name != current_employee:
                 if keyboard:
@@ -1872,6 +1389,88 @@ async def select_active_task_cancel(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text("Не удалось определить ID задачи. Пожалуйста, выберите задачу из списка.")
         return SELECT_ACTIVE_TASK_CANCEL
 
+# Описание фильтров истории задач для заголовка страницы
+def describe_history_filters(user_data):
+    filters_text = []
+    
+    if user_data.get('history_start_date') is not None:
+        start_datetime = database.from_timestamp(user_data['history_start_date'])
+        # Конец периода хранится как начало следующего дня
+        end_datetime = database.from_timestamp(user_data['history_end_date']) - timedelta(days=1)
+        filters_text.append(f"📅 {start_datetime.strftime('%d.%m.%Y')} - {end_datetime.strftime('%d.%m.%Y')}")
+    
+    if user_data.get('history_task_id') is not None:
+        filters_text.append(f"🎯 {user_data['history_task_name']}")
+    
+    return ", ".join(filters_text)
+
+# Отправка страницы истории задач выбранного сотрудника.
+# direction: None - первая (самая новая) страница, 'older' - следующая, 'newer' - предыдущая.
+# Возвращает False, если в этом направлении задач нет.
+async def send_history_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None):
+    user_data = context.user_data
+    before = user_data['history_page_last'] if direction == 'older' else None
+    after = user_data['history_page_first'] if direction == 'newer' else None
+    
+    completed_tasks = await database.run_read(
+        queries.get_task_history_page,
+        user_data['history_employee_id'],
+        HISTORY_PAGE_SIZE,
+        before,
+        after,
+        user_data.get('history_start_date'),
+        user_data.get('history_end_date'),
+        user_data.get('history_task_id')
+    )
+    
+    if not completed_tasks:
+        return False
+    
+    # Ключи (end_time, id) первой и последней строки для перехода к соседним страницам
+    user_data['history_page_first'] = [completed_tasks[0][4], completed_tasks[0][0]]
+    user_data['history_page_last'] = [completed_tasks[-1][4], completed_tasks[-1][0]]
+    if direction is None:
+        user_data['history_page_number'] = 1
+    elif direction == 'older':
+        user_data['history_page_number'] += 1
+    else:
+        user_data['history_page_number'] -= 1
+    
+    response = f"📋 *История выполненных задач сотрудника {user_data['history_employee_name']}*\n"
+    response += f"_Страница {user_data['history_page_number']}_\n"
+    filters_text = describe_history_filters(user_data)
+    if filters_text:
+        response += f"_Фильтр: {filters_text}_\n"
+    response += "\n"
+    
+    for task in completed_tasks:
+        _, task_name, points, start_time, end_time, duration = task
+        
+        start_datetime = database.from_timestamp(start_time)
+        end_datetime = database.from_timestamp(end_time)
+        
+        response += f"📝 *{task_name}*\n"
+        response += f"🏆 Очки: {points}\n"
+        response += f"⏱ Время выполнения: {round(duration, 2)} мин.\n"
+        response += f"🕒 Начало: {start_datetime.strftime('%d.%m.%Y %H:%M')}\n"
+        response += f"🏁 Завершение: {end_datetime.strftime('%d.%m.%Y %H:%M')}\n\n"
+    
+    keyboard = [
+        ["⬅️ Новее", "Старее ➡️"],
+        ["📅 Период", "🎯 Задача"],
+        ["♻️ Сбросить фильтры", "🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+    return True
+
+# Сброс фильтров и позиции в истории задач
+def reset_history_filters(user_data):
+    user_data['history_start_date'] = None
+    user_data['history_end_date'] = None
+    user_data['history_task_id'] = None
+    user_data['history_task_name'] = None
+
 # Обработчик просмотра истории задач
 async def view_task_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
@@ -1882,6 +1481,7 @@ async def view_task_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1891,87 +1491,323 @@ async def view_task_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         employee_id = int(text.split("ID: ")[1])
         employee_name = text.split(" - ID:")[0]
+    except (IndexError, ValueError):
+        await update.message.reply_text("Не удалось определить ID сотрудника. Пожалуйста, выберите сотрудника из списка.")
+        return VIEW_TASK_HISTORY
+    
+    context.user_data['history_employee_id'] = employee_id
+    context.user_data['history_employee_name'] = employee_name
+    reset_history_filters(context.user_data)
+    
+    # Показываем первую страницу истории
+    if await send_history_page(update, context):
+        return TASK_HISTORY_PAGE
+    
+    await update.message.reply_text(f"У сотрудника {employee_name} нет выполненных задач в истории.")
+    
+    keyboard = [
+        ["👤 Добавить сотрудника", "📋 Добавить задачу"],
+        ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
+        ["📝 Назначить задачу", "📊 Аналитика"],
+        ["📋 История задач", "❌ Отменить активную задачу"],
+        ["📤 Экспорт", "📣 Рассылка"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text("Меню администратора", reply_markup=reply_markup)
+    return ADMIN_MENU
+
+# Обработчик навигации по страницам истории задач
+async def task_history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == "Старее ➡️":
+        if not await send_history_page(update, context, 'older'):
+            await update.message.reply_text("Более ранних задач нет.")
+        return TASK_HISTORY_PAGE
+    
+    elif text == "⬅️ Новее":
+        if not await send_history_page(update, context, 'newer'):
+            await update.message.reply_text("Это первая страница.")
+        return TASK_HISTORY_PAGE
+    
+    elif text == "📅 Период":
+        keyboard = [["🔙 Назад"]]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text(
+            "Введите дату или период в формате ДД.ММ.ГГГГ или ДД.ММ.ГГГГ-ДД.ММ.ГГГГ:",
+            reply_markup=reply_markup
+        )
+        return TASK_HISTORY_PERIOD
+    
+    elif text == "🎯 Задача":
+        tasks, reply_markup = await cache.tasks.get()
+        await update.message.reply_text("Выберите задачу для фильтра:", reply_markup=reply_markup)
+        return TASK_HISTORY_TASK
+    
+    elif text == "♻️ Сбросить фильтры":
+        reset_history_filters(context.user_data)
+        if not await send_history_page(update, context):
+            await update.message.reply_text("Нет выполненных задач.")
+        return TASK_HISTORY_PAGE
+    
+    elif text == "🔙 Назад":
+        employees = await database.run_read(queries.get_active_employees)
         
-        conn = sqlite3.connect('shoeshop.db')
-        cursor = conn.cursor()
-        
-        # Получаем последние 20 выполненных задач сотрудника
-        cursor.execute("""
-            SELECT 
-                c.id,
-                t.name as task_name,
-                c.points_earned,
-                c.start_time,
-                c.end_time,
-                c.duration_seconds / 60.0 as duration_minutes
-            FROM completed_tasks c
-            JOIN tasks t ON c.task_id = t.id
-            WHERE c.employee_id = ?
-            ORDER BY c.end_time DESC
-            LIMIT 20
-        """, (employee_id,))
-        
-        completed_tasks = cursor.fetchall()
-        conn.close()
-        
-        if not completed_tasks:
-            await update.message.reply_text(f"У сотрудника {employee_name} нет выполненных задач в истории.")
-            
-            keyboard = [
-                ["👤 Добавить сотрудника", "📋 Добавить задачу"],
-                ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
-                ["📝 Назначить задачу", "📊 Аналитика"],
-                ["📋 История задач", "❌ Отменить активную задачу"],
-                ["🔙 Назад"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            await update.message.reply_text("Меню администратора", reply_markup=reply_markup)
-            return ADMIN_MENU
+        keyboard = []
+        for emp_id, emp_name in employees:
+            keyboard.append([f"{emp_name} - ID: {emp_id}"])
         
-        response = f"📋 *История выполненных задач сотрудника {employee_name} (последние 20)*\n\n"
+        keyboard.append(["🔙 Назад"])
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
-        for task in completed_tasks:
-            _, task_name, points, start_time, end_time, duration = task
-            
-            start_datetime = datetime.fromisoformat(start_time)
-            end_datetime = datetime.fromisoformat(end_time)
-            
-            response += f"📝 *{task_name}*\n"
-            response += f"🏆 Очки: {points}\n"
-            response += f"⏱ Время выполнения: {round(duration, 2)} мин.\n"
-            response += f"🕒 Начало: {start_datetime.strftime('%d.%m.%Y %H:%M')}\n"
-            response += f"🏁 Завершение: {end_datetime.strftime('%d.%m.%Y %H:%M')}\n\n"
+        await update.message.reply_text("Выберите сотрудника для просмотра истории задач:", reply_markup=reply_markup)
+        return VIEW_TASK_HISTORY
+    
+    else:
+        await update.message.reply_text("Неверная команда. Пожалуйста, используйте кнопки меню.")
+        return TASK_HISTORY_PAGE
+
+# Обработчик ввода периода для фильтра истории задач
+async def task_history_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    
+    if text != "🔙 Назад":
+        try:
+            start_text, _, end_text = text.partition("-")
+            start_date = datetime.strptime(start_text.strip(), "%d.%m.%Y")
+            end_date = datetime.strptime(end_text.strip(), "%d.%m.%Y") if end_text else start_date
+        except ValueError:
+            await update.message.reply_text(
+                "Неверный формат. Введите дату или период в формате ДД.ММ.ГГГГ или ДД.ММ.ГГГГ-ДД.ММ.ГГГГ:"
+            )
+            return TASK_HISTORY_PERIOD
         
-        await update.message.reply_text(response, parse_mode='Markdown')
+        if end_date < start_date:
+            start_date, end_date = end_date, start_date
+        
+        # Последний день периода включается целиком
+        context.user_data['history_start_date'] = database.to_timestamp(start_date)
+        context.user_data['history_end_date'] = database.to_timestamp(end_date + timedelta(days=1))
+    
+    if not await send_history_page(update, context):
+        keyboard = [
+            ["📅 Период", "🎯 Задача"],
+            ["♻️ Сбросить фильтры", "🔙 Назад"]
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Нет выполненных задач по выбранному фильтру.", reply_markup=reply_markup)
+    return TASK_HISTORY_PAGE
+
+# Обработчик выбора задачи для фильтра истории задач
+async def task_history_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text != "🔙 Назад":
+        # Проверяем, что это не заголовок категории
+        if text.startswith("--- ") and text.endswith(" ---"):
+            await update.message.reply_text("Это заголовок категории. Пожалуйста, выберите задачу.")
+            return TASK_HISTORY_TASK
         
+        try:
+            task_id = await parse_task_id(text)
+        except (IndexError, ValueError):
+            await update.message.reply_text("Не удалось определить ID задачи. Пожалуйста, выберите задачу из списка.")
+            return TASK_HISTORY_TASK
+        
+        context.user_data['history_task_id'] = task_id
+        context.user_data['history_task_name'] = text.split(" (")[0]
+    
+    if not await send_history_page(update, context):
+        keyboard = [
+            ["📅 Период", "🎯 Задача"],
+            ["♻️ Сбросить фильтры", "🔙 Назад"]
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Нет выполненных задач по выбранному фильтру.", reply_markup=reply_markup)
+    return TASK_HISTORY_PAGE
+
+# Обработчик выбора периода для выгрузки
+async def export_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == "🔙 Назад":
         keyboard = [
             ["👤 Добавить сотрудника", "📋 Добавить задачу"],
             ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
             ["📝 Назначить задачу", "📊 Аналитика"],
             ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
             ["🔙 Назад"]
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text("Меню администратора", reply_markup=reply_markup)
         return ADMIN_MENU
-        
-    except (IndexError, ValueError):
-        await update.message.reply_text("Не удалось определить ID сотрудника. Пожалуйста, выберите сотрудника из списка.")
-        return VIEW_TASK_HISTORY
+    
+    start_date, period_name = parse_period(text)
+    
+    if start_date is None:
+        await update.message.reply_text("Пожалуйста, выберите период из предложенных вариантов.")
+        return EXPORT_PERIOD
+    
+    context.user_data['export_start_date'] = start_date.isoformat()
+    context.user_data['export_period_name'] = period_name
+    
+    keyboard = [
+        ["📄 CSV", "🗜 CSV (gzip)"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text("Выберите формат файла:", reply_markup=reply_markup)
+    return EXPORT_FORMAT
+
+# Обработчик выбора формата и отправки выгрузки
+async def export_format(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == "🔙 Назад":
+        keyboard = [
+            ["За сегодня", "За неделю"],
+            ["За месяц", "За всё время"],
+            ["🔙 Назад"]
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Выберите период для выгрузки выполненных задач:", reply_markup=reply_markup)
+        return EXPORT_PERIOD
+    
+    if text not in ("📄 CSV", "🗜 CSV (gzip)"):
+        await update.message.reply_text("Пожалуйста, выберите формат из предложенных вариантов.")
+        return EXPORT_FORMAT
+    
+    compress = text == "🗜 CSV (gzip)"
+    start_date = datetime.fromisoformat(context.user_data['export_start_date'])
+    period_name = context.user_data['export_period_name']
+    
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    
+    # Файл пишется в потоке чтения базы, цикл событий не блокируется
+    path, rows = await database.run_read(
+        export.write_completed_tasks_csv, database.to_timestamp(start_date), None, compress
+    )
+    
+    try:
+        size = os.path.getsize(path)
+        if not rows:
+            await update.message.reply_text(f"Нет выполненных задач за {period_name}.")
+        elif size > export.EXPORT_MAX_FILE_SIZE:
+            await update.message.reply_text(
+                f"Файл выгрузки за {period_name} слишком большой ({size / 1024 / 1024:.1f} МБ), "
+                f"Telegram принимает файлы до {export.EXPORT_MAX_FILE_SIZE // 1024 // 1024} МБ. "
+                + ("Выберите период короче." if compress else "Выберите период короче или формат CSV (gzip).")
+            )
+        else:
+            filename = f"completed_tasks_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+            if compress:
+                filename += ".gz"
+            
+            # Файл не читается в память целиком: его частями читает HTTP-клиент при отправке
+            with open(path, 'rb') as document:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=InputFile(document, filename=filename, read_file_handle=False),
+                    caption=f"📤 Выполненные задачи за {period_name}: {rows}"
+                )
+    finally:
+        os.remove(path)
+    
+    keyboard = [
+        ["👤 Добавить сотрудника", "📋 Добавить задачу"],
+        ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
+        ["📝 Назначить задачу", "📊 Аналитика"],
+        ["📋 История задач", "❌ Отменить активную задачу"],
+        ["📤 Экспорт", "📣 Рассылка"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text("Меню администратора", reply_markup=reply_markup)
+    return ADMIN_MENU
+
+# Обработчик ввода текста рассылки
+async def broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == "🔙 Назад":
+        keyboard = [
+            ["👤 Добавить сотрудника", "📋 Добавить задачу"],
+            ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
+            ["📝 Назначить задачу", "📊 Аналитика"],
+            ["📋 История задач", "❌ Отменить активную задачу"],
+            ["📤 Экспорт", "📣 Рассылка"],
+            ["🔙 Назад"]
+        ]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Меню администратора", reply_markup=reply_markup)
+        return ADMIN_MENU
+    
+    recipients = await database.run_read(queries.count_broadcast_recipients)
+    if not recipients:
+        await update.message.reply_text("Нет активных сотрудников с привязанным Telegram. Введите текст позже или вернитесь назад.")
+        return BROADCAST_TEXT
+    
+    context.user_data['broadcast_text'] = text
+    
+    keyboard = [
+        ["✅ Отправить"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text(
+        f"Сообщение будет отправлено {recipients} сотрудникам:\n\n{text}",
+        reply_markup=reply_markup
+    )
+    return BROADCAST_CONFIRM
+
+# Обработчик подтверждения рассылки
+async def broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    
+    if text == "🔙 Назад":
+        keyboard = [["🔙 Назад"]]
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        await update.message.reply_text("Введите текст сообщения:", reply_markup=reply_markup)
+        return BROADCAST_TEXT
+    
+    if text != "✅ Отправить":
+        await update.message.reply_text("Пожалуйста, используйте кнопки меню.")
+        return BROADCAST_CONFIRM
+    
+    # Сообщения ставятся в очередь уведомлений одной транзакцией и отправляются в фоне
+    # с ограничением скорости; об итогах администратор получит отдельное сообщение
+    broadcast_id, total = await database.run_write(
+        queries.create_broadcast, context.user_data.pop('broadcast_text'),
+        update.effective_chat.id, database.now_timestamp()
+    )
+    notifications.sender.wake()
+    
+    keyboard = [
+        ["👤 Добавить сотрудника", "📋 Добавить задачу"],
+        ["✏️ Изменить сотрудника", "✏️ Изменить задачу"],
+        ["📝 Назначить задачу", "📊 Аналитика"],
+        ["📋 История задач", "❌ Отменить активную задачу"],
+        ["📤 Экспорт", "📣 Рассылка"],
+        ["🔙 Назад"]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await update.message.reply_text(
+        f"📣 Рассылка #{broadcast_id} поставлена в очередь: {total} получателей. "
+        f"Когда она завершится, я пришлю отчёт.",
+        reply_markup=reply_markup
+    )
+    return ADMIN_MENU
 
-# Обработчик команды регистрации сотрудника
 # Обработчик команды регистрации сотрудника
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Проверяем, зарегистрирован ли уже пользователь
-    conn = sqlite3.connect('shoeshop.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM employees WHERE telegram_id = ?", (user_id,))
-    existing_employee = cursor.fetchone()
+    existing_employee = await cache.identities.get(user_id)
     
     if existing_employee:
-        conn.close()
         await update.message.reply_text(
             f"Вы уже зарегистрированы как сотрудник {existing_employee[1]} (ID: {existing_employee[0]})."
         )
@@ -1979,7 +1815,6 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверяем, передан ли ID сотрудника
     if not context.args:
-        conn.close()
         await update.message.reply_text(
             "Для регистрации укажите ваш ID сотрудника: /register ID\n"
             "Например: /register 123"
@@ -1990,38 +1825,26 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
         employee_id = int(context.args[0])
         
         # Проверяем, существует ли сотрудник с таким ID
-        cursor.execute("SELECT name, active FROM employees WHERE id = ?", (employee_id,))
-        employee = cursor.fetchone()
+        employee = await database.run_read(queries.get_employee, employee_id)
         
         if not employee:
-            conn.close()
             await update.message.reply_text(f"Сотрудник с ID {employee_id} не найден.")
             return
         
-        employee_name, is_active = employee
+        employee_name, is_active, telegram_id = employee
         
         if not is_active:
-            conn.close()
             await update.message.reply_text(f"Сотрудник с ID {employee_id} деактивирован. Обратитесь к администратору.")
             return
         
         # Проверяем, не привязан ли уже этот сотрудник к другому аккаунту
-        cursor.execute("SELECT telegram_id FROM employees WHERE id = ?", (employee_id,))
-        telegram_id = cursor.fetchone()[0]
-        
         if telegram_id and telegram_id != user_id:
-            conn.close()
             await update.message.reply_text("Этот сотрудник уже привязан к другому аккаунту Telegram.")
             return
         
         # Привязываем Telegram ID к сотруднику
-        cursor.execute(
-            "UPDATE employees SET telegram_id = ? WHERE id = ?",
-            (user_id, employee_id)
-        )
-        
-        conn.commit()
-        conn.close()
+        await database.run_write(queries.bind_telegram_id, employee_id, user_id)
+        cache.identities.invalidate(user_id)
         
         await update.message.reply_text(
             f"✅ Вы успешно зарегистрированы как сотрудник {employee_name}.\n"
@@ -2040,24 +1863,174 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Выберите режим работы:", reply_markup=reply_markup)
         
     except ValueError:
-        conn.close()
         await update.message.reply_text("ID сотрудника должен быть числом.")
 
+# Обработчик команды пересчёта суточных сводок аналитики по всем выполненным задачам
+async def rebuild_rollups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("Эта команда доступна только администраторам.")
+        return
+    
+    await update.message.reply_text("⏳ Пересчитываю сводки аналитики...")
+    total = await database.run_write(queries.rebuild_rollups)
+    analytics_columnar.reset()
+    cache.analytics.invalidate()
+    
+    await update.message.reply_text(f"✅ Сводки аналитики пересчитаны. Учтено выполненных задач: {total}.")
+
+
+# Периодический перенос WAL в основной файл базы, чтобы WAL-файл не рос бесконечно
+async def checkpoint_wal(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await database.checkpoint()
+    except Exception as e:
+        logger.error(f"Не удалось выполнить checkpoint WAL: {e}")
+
+# Периодический перенос выполненных задач старше database.ARCHIVE_AFTER_DAYS дней в архивную базу.
+# Переносится по одному дню за операцию записи, чтобы не задерживать остальные изменения.
+# Результаты аналитики не меняются, поэтому кэш не сбрасывается.
+async def archive_completed_tasks(context: ContextTypes.DEFAULT_TYPE):
+    cutoff_day = database.now_timestamp() // 86400 - database.ARCHIVE_AFTER_DAYS
+    day = 0
+    archived = 0
+    try:
+        while True:
+            day = await database.run_read(queries.get_next_day_to_archive, day, cutoff_day)
+            if day is None:
+                break
+
+            moved = await database.run_write(queries.archive_day, day)
+            if moved is None:
+                logger.warning(
+                    f"Выполненные задачи за {database.from_timestamp(day * 86400).date()} не перенесены "
+                    f"в архив: сводки не совпадают с задачами, выполните /rebuild_rollups"
+                )
+            else:
+                archived += moved
+            day += 1
+    except Exception as e:
+        logger.error(f"Не удалось перенести выполненные задачи в архив: {e}")
+
+    if archived:
+        logger.info(f"Перенесено в архив выполненных задач: {archived}")
+
+# Построение отчётов аналитики за день, неделю и месяц заранее, чтобы администратор
+# получал их из кэша. only_missing - строить только отсутствующие в кэше отчёты.
+# Возвращает количество построенных отчётов.
+async def _precompute_analytics(only_missing):
+    built = 0
+    for period in ANALYTICS_PRECOMPUTE_PERIODS:
+        start_date, period_name = parse_period(period)
+        for kind, show_all in ANALYTICS_PRECOMPUTE_REPORTS:
+            key = analytics_cache_key(kind, start_date, period_name, show_all)
+            if only_missing and key in cache.analytics:
+                continue
+            await get_analytics_report(kind, start_date, period_name, show_all, warm=True)
+            built += 1
+    return built
+
+# Построение отчётов аналитики по расписанию (cache.ANALYTICS_PRECOMPUTE_TIMES)
+async def precompute_analytics(context: ContextTypes.DEFAULT_TYPE):
+    schedule_precompute_analytics(context.job_queue)
+    try:
+        built = await _precompute_analytics(only_missing=False)
+    except Exception as e:
+        logger.error(f"Не удалось заранее построить отчёты аналитики: {e}")
+        return
+    logger.info(f"Заранее построено отчётов аналитики: {built}")
+
+# Постановка следующего запуска precompute_analytics: ближайшее время из
+# cache.ANALYTICS_PRECOMPUTE_TIMES по местным часам магазина. Смещение часового пояса
+# берётся на дату запуска, а запуск планируется заново после каждого, поэтому
+# переход на летнее и зимнее время не сдвигает расписание.
+def schedule_precompute_analytics(job_queue):
+    now = datetime.now()
+    next_runs = []
+    for precompute_time in cache.ANALYTICS_PRECOMPUTE_TIMES:
+        run_at = datetime.combine(now.date(), precompute_time)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        next_runs.append(run_at)
+
+    # astimezone() у времени без пояса подставляет системный пояс со смещением на эту дату
+    job_queue.run_once(precompute_analytics, when=min(next_runs).astimezone(), name="precompute_analytics")
+
+# Построение сброшенных отчётов аналитики, когда данные перестали меняться
+# (нет завершённых задач и правок дольше cache.ANALYTICS_QUIET_PERIOD секунд)
+async def precompute_analytics_when_quiet(context: ContextTypes.DEFAULT_TYPE):
+    if cache.analytics.idle_seconds() < cache.ANALYTICS_QUIET_PERIOD:
+        return
+    try:
+        built = await _precompute_analytics(only_missing=True)
+    except Exception as e:
+        logger.error(f"Не удалось заранее построить отчёты аналитики: {e}")
+        return
+    if built:
+        logger.info(f"Заранее построено отчётов аналитики после затишья: {built}")
+
+# Запуск фоновых задач (потоки базы данных запускаются раньше, в main)
+async def on_startup(application: Application):
+    notifications.sender.start(application.bot)
+    application.job_queue.run_repeating(
+        checkpoint_wal,
+        interval=database.WAL_CHECKPOINT_INTERVAL,
+        first=database.WAL_CHECKPOINT_INTERVAL,
+        name="wal_checkpoint"
+    )
+    if database.ARCHIVE_AFTER_DAYS is not None:
+        application.job_queue.run_repeating(
+            archive_completed_tasks,
+            interval=database.ARCHIVE_INTERVAL,
+            first=10,
+            name="archive_completed_tasks"
+        )
+
+    schedule_precompute_analytics(application.job_queue)
+    application.job_queue.run_repeating(
+        precompute_analytics_when_quiet,
+        interval=cache.ANALYTICS_QUIET_CHECK_INTERVAL,
+        first=cache.ANALYTICS_QUIET_CHECK_INTERVAL,
+        name="precompute_analytics_when_quiet"
+    )
+
+# Освобождение ресурсов при остановке бота
+async def on_shutdown(application: Application):
+    await notifications.sender.stop()
+    database.shutdown()
 
 # Основная функция
 def main():
+    # Без адреса и секрета webhook не запустится - проверяем до всего остального
+    if USE_WEBHOOK and not (WEBHOOK_URL and WEBHOOK_SECRET_TOKEN):
+        raise RuntimeError("Для работы через webhook задайте переменные окружения WEBHOOK_URL и WEBHOOK_SECRET_TOKEN")
+
     # Инициализация базы данных
     init_db()
     fill_initial_data()
     
-    # Создание механизма персистентности для сохранения состояния разговоров
-    persistence = PicklePersistence(filepath="shoeshop_bot_data.pickle")
+    # Потоки базы данных нужны уже при инициализации приложения: персистентность
+    # загружает состояние разговоров и данные пользователей через database.run_read
+    database.start()
+    
+    # Состояние разговоров и данные пользователей хранятся в базе
+    bot_persistence = persistence.SQLitePersistence()
     
     # Создание приложения с персистентностью
-    application = Application.builder().token("").persistence(persistence).build()
+    application = (
+        Application.builder()
+        .token("")
+        .persistence(bot_persistence)
+        .update_queue(update_processor.UpdateQueue(UPDATE_QUEUE_SIZE))
+        # Обновления разных чатов обрабатываются параллельно, одного чата - по очереди
+        .concurrent_updates(update_processor.PerChatUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Регистрация обработчиков
     application.add_handler(CommandHandler("register", register))
+    application.add_handler(CommandHandler("rebuild_rollups", rebuild_rollups))
     
     # Обработчик разговора
     conv_handler = ConversationHandler(
@@ -2088,6 +2061,13 @@ def main():
             EDIT_TASK_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_task_category)],
             SELECT_ACTIVE_TASK_CANCEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_active_task_cancel)],
             VIEW_TASK_HISTORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, view_task_history)],
+            TASK_HISTORY_PAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_history_page)],
+            TASK_HISTORY_PERIOD: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_history_period)],
+            TASK_HISTORY_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_history_task)],
+            EXPORT_PERIOD: [MessageHandler(filters.TEXT & ~filters.COMMAND, export_period)],
+            EXPORT_FORMAT: [MessageHandler(filters.TEXT & ~filters.COMMAND, export_format)],
+            BROADCAST_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_text)],
+            BROADCAST_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_confirm)],
         },
         fallbacks=[CommandHandler("start", start)],
         name="main_conversation",
@@ -2097,7 +2077,20 @@ def main():
     application.add_handler(conv_handler)
     
     # Запуск бота
-    application.run_polling()
+    if USE_WEBHOOK:
+        # Для локальной проверки можно отправить записанный Update JSON запросом POST
+        # на http://WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH с заголовком
+        # X-Telegram-Bot-Api-Secret-Token (секрет задаётся переменной окружения)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
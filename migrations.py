@@ -0,0 +1,510 @@
+import logging
+
+import sketches
+
+logger = logging.getLogger(__name__)
+
+# Версионные миграции схемы базы данных.
+# Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+# выполняется в отдельной транзакции вместе с обновлением версии, поэтому
+# существующий shoeshop.db обновляется на месте и никогда не остаётся
+# в промежуточном состоянии.
+# Архивная база (схема archive, см. database.ARCHIVE_DB_PATH) версионируется отдельно
+# своим PRAGMA archive.user_version и обновляется раньше основной: пересчёт сводок
+# в миграциях основной базы читает обе таблицы выполненных задач.
+# Миграции не вызывают функции queries: SQL каждой миграции зафиксирован здесь,
+# чтобы изменения запросов бота не меняли уже выпущенные миграции.
+
+
+# 1: исходная схема (таблицы могут уже существовать в старых базах)
+def _create_tables(conn):
+    # Таблица сотрудников
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS employees (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        salary REAL NOT NULL,
+        telegram_id INTEGER UNIQUE,
+        active BOOLEAN DEFAULT 1
+    )
+    ''')
+
+    # Таблица задач
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        points INTEGER NOT NULL,
+        category TEXT NOT NULL
+    )
+    ''')
+
+    # Таблица активных задач
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS active_tasks (
+        id INTEGER PRIMARY KEY,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time TEXT NOT NULL,
+        FOREIGN KEY (employee_id) REFERENCES employees (id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+
+    # Таблица выполненных задач
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS completed_tasks (
+        id INTEGER PRIMARY KEY,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT NOT NULL,
+        points_earned INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        FOREIGN KEY (employee_id) REFERENCES employees (id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+
+
+# 2: индексы для аналитики, истории и поиска активных задач
+def _add_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_tasks_end_time ON completed_tasks (end_time)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_completed_tasks_employee_end_time "
+        "ON completed_tasks (employee_id, end_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_completed_tasks_task_end_time "
+        "ON completed_tasks (task_id, end_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_active_tasks_employee_task "
+        "ON active_tasks (employee_id, task_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_employees_active_telegram_id "
+        "ON employees (telegram_id) WHERE active = 1"
+    )
+    # Обновляем статистику планировщика запросов для новых индексов
+    conn.execute("ANALYZE")
+
+
+# 3: время начала и окончания хранится целым числом секунд вместо ISO-строки
+# (см. database.to_timestamp), у выполненных задач появляется вычисляемый день недели.
+# SQLite не умеет менять тип столбца, поэтому таблицы пересоздаются.
+def _integer_timestamps(conn):
+    conn.execute('''
+    CREATE TABLE active_tasks_new (
+        id INTEGER PRIMARY KEY,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        FOREIGN KEY (employee_id) REFERENCES employees (id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO active_tasks_new (id, employee_id, task_id, start_time)
+    SELECT id, employee_id, task_id, CAST(strftime('%s', start_time) AS INTEGER)
+    FROM active_tasks
+    ''')
+    conn.execute("DROP TABLE active_tasks")
+    conn.execute("ALTER TABLE active_tasks_new RENAME TO active_tasks")
+
+    conn.execute('''
+    CREATE TABLE completed_tasks_new (
+        id INTEGER PRIMARY KEY,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        points_earned INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        weekday INTEGER GENERATED ALWAYS AS (CAST(strftime('%w', end_time, 'unixepoch') AS INTEGER)) VIRTUAL,
+        FOREIGN KEY (employee_id) REFERENCES employees (id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO completed_tasks_new
+    (id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds)
+    SELECT
+        id,
+        employee_id,
+        task_id,
+        CAST(strftime('%s', start_time) AS INTEGER),
+        CAST(strftime('%s', end_time) AS INTEGER),
+        points_earned,
+        duration_seconds
+    FROM completed_tasks
+    ''')
+    conn.execute("DROP TABLE completed_tasks")
+    conn.execute("ALTER TABLE completed_tasks_new RENAME TO completed_tasks")
+
+    # Индексы удалены вместе со старыми таблицами
+    _add_indexes(conn)
+
+
+# 4: суточные сводки по сотрудникам, задачам и категориям
+def _daily_rollups(conn):
+    totals = """
+        task_count INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        duration_sum REAL NOT NULL,
+        duration_min REAL NOT NULL,
+        duration_max REAL NOT NULL,
+    """
+    conn.execute(f'''
+    CREATE TABLE daily_employee_stats (
+        day INTEGER NOT NULL,
+        employee_id INTEGER NOT NULL,
+        {totals}
+        PRIMARY KEY (day, employee_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute(f'''
+    CREATE TABLE daily_task_stats (
+        day INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        {totals}
+        PRIMARY KEY (day, task_id)
+    ) WITHOUT ROWID
+    ''')
+    # Сотрудник в ключе нужен, чтобы общая статистика учитывала только активных сотрудников
+    conn.execute(f'''
+    CREATE TABLE daily_category_stats (
+        day INTEGER NOT NULL,
+        employee_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        {totals}
+        PRIMARY KEY (day, employee_id, category)
+    ) WITHOUT ROWID
+    ''')
+
+    # Заполняем сводки по уже выполненным задачам
+    conn.execute('''
+    INSERT INTO daily_employee_stats
+    (day, employee_id, task_count, points, duration_sum, duration_min, duration_max)
+    SELECT
+        end_time / 86400,
+        employee_id,
+        COUNT(*),
+        SUM(points_earned),
+        SUM(duration_seconds),
+        MIN(duration_seconds),
+        MAX(duration_seconds)
+    FROM all_completed_tasks
+    GROUP BY end_time / 86400, employee_id
+    ''')
+    conn.execute('''
+    INSERT INTO daily_task_stats
+    (day, task_id, task_count, points, duration_sum, duration_min, duration_max)
+    SELECT
+        end_time / 86400,
+        task_id,
+        COUNT(*),
+        SUM(points_earned),
+        SUM(duration_seconds),
+        MIN(duration_seconds),
+        MAX(duration_seconds)
+    FROM all_completed_tasks
+    GROUP BY end_time / 86400, task_id
+    ''')
+    conn.execute('''
+    INSERT INTO daily_category_stats
+    (day, employee_id, category, task_count, points, duration_sum, duration_min, duration_max)
+    SELECT
+        c.end_time / 86400,
+        c.employee_id,
+        t.category,
+        COUNT(*),
+        SUM(c.points_earned),
+        SUM(c.duration_seconds),
+        MIN(c.duration_seconds),
+        MAX(c.duration_seconds)
+    FROM all_completed_tasks c
+    JOIN tasks t ON c.task_id = t.id
+    GROUP BY c.end_time / 86400, c.employee_id, t.category
+    ''')
+
+
+# 5: итоги сотрудников за всё время для личной статистики
+def _employee_summaries(conn):
+    conn.execute('''
+    CREATE TABLE employee_summary (
+        employee_id INTEGER PRIMARY KEY,
+        task_count INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        duration_sum REAL NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE employee_category_summary (
+        employee_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        task_count INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        PRIMARY KEY (employee_id, category)
+    ) WITHOUT ROWID
+    ''')
+
+    # Итоги заполняются из суточных сводок (миграция 4)
+    conn.execute('''
+    INSERT INTO employee_summary (employee_id, task_count, points, duration_sum)
+    SELECT employee_id, SUM(task_count), SUM(points), SUM(duration_sum)
+    FROM daily_employee_stats
+    GROUP BY employee_id
+    ''')
+    conn.execute('''
+    INSERT INTO employee_category_summary (employee_id, category, task_count, points)
+    SELECT employee_id, category, SUM(task_count), SUM(points)
+    FROM daily_category_stats
+    GROUP BY employee_id, category
+    ''')
+
+
+# 6: скетчи времени выполнения по задачам (за каждый день и за всё время) и по сотрудникам
+def _duration_sketches(conn):
+    conn.execute('''
+    CREATE TABLE daily_task_duration_sketch (
+        day INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, task_id, bucket)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE task_duration_sketch (
+        task_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (task_id, bucket)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE employee_duration_sketch (
+        employee_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (employee_id, bucket)
+    ) WITHOUT ROWID
+    ''')
+
+    # Номера корзин берутся из sketches: они должны совпадать с теми, что пишет бот
+    daily_task = {}
+    task = {}
+    employee = {}
+    cursor = conn.execute("SELECT end_time, employee_id, task_id, duration_seconds FROM all_completed_tasks")
+    for end_time, employee_id, task_id, duration_seconds in cursor:
+        bucket = sketches.bucket_index(duration_seconds)
+        for counts, key in (
+            (daily_task, (end_time // 86400, task_id, bucket)),
+            (task, (task_id, bucket)),
+            (employee, (employee_id, bucket)),
+        ):
+            counts[key] = counts.get(key, 0) + 1
+
+    conn.executemany(
+        "INSERT INTO daily_task_duration_sketch (day, task_id, bucket, count) VALUES (?, ?, ?, ?)",
+        [key + (count,) for key, count in daily_task.items()]
+    )
+    conn.executemany(
+        "INSERT INTO task_duration_sketch (task_id, bucket, count) VALUES (?, ?, ?)",
+        [key + (count,) for key, count in task.items()]
+    )
+    conn.executemany(
+        "INSERT INTO employee_duration_sketch (employee_id, bucket, count) VALUES (?, ?, ?)",
+        [key + (count,) for key, count in employee.items()]
+    )
+
+
+# 7: индекс для истории задач сотрудника с фильтром по задаче
+def _history_task_index(conn):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_completed_tasks_employee_task_end_time "
+        "ON completed_tasks (employee_id, task_id, end_time)"
+    )
+
+
+# 8: id выполненных задач больше не переиспользуются. Старые задачи переносятся
+# в архив с теми же id, и новая задача не должна получить id уже перенесённой,
+# даже если горячая таблица опустела.
+def _completed_tasks_autoincrement(conn):
+    conn.execute('''
+    CREATE TABLE completed_tasks_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        points_earned INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        weekday INTEGER GENERATED ALWAYS AS (CAST(strftime('%w', end_time, 'unixepoch') AS INTEGER)) VIRTUAL,
+        FOREIGN KEY (employee_id) REFERENCES employees (id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO completed_tasks_new
+    (id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds)
+    SELECT id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds
+    FROM completed_tasks
+    ''')
+    conn.execute("DROP TABLE completed_tasks")
+    conn.execute("ALTER TABLE completed_tasks_new RENAME TO completed_tasks")
+
+    _add_indexes(conn)
+    _history_task_index(conn)
+
+
+# 9: очередь уведомлений сотрудникам (см. notifications). Отправленные уведомления
+# удаляются, неотправляемые остаются со статусом 'failed'.
+def _notification_outbox(conn):
+    conn.execute('''
+    CREATE TABLE notification_outbox (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        next_attempt_at INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        last_error TEXT
+    )
+    ''')
+    conn.execute(
+        "CREATE INDEX idx_notification_outbox_pending "
+        "ON notification_outbox (next_attempt_at) WHERE status = 'pending'"
+    )
+
+
+# 10: рассылки администраторов всем сотрудникам. Сообщения рассылки идут через
+# notification_outbox, счётчики доставленных и недоставленных ведутся в broadcasts.
+def _broadcasts(conn):
+    conn.execute('''
+    CREATE TABLE broadcasts (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        admin_chat_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("ALTER TABLE notification_outbox ADD COLUMN broadcast_id INTEGER REFERENCES broadcasts (id)")
+
+
+# 11: состояние бота (разговоры, user_data, chat_data, bot_data) вместо файла
+# PicklePersistence, по строке на ключ (см. persistence.SQLitePersistence)
+def _persistence_tables(conn):
+    conn.execute('''
+    CREATE TABLE persistence_data (
+        kind TEXT NOT NULL,
+        owner_id INTEGER NOT NULL,
+        key BLOB NOT NULL,
+        value BLOB NOT NULL,
+        PRIMARY KEY (kind, owner_id, key)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE persistence_conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state BLOB NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    ''')
+
+
+# Список миграций: (версия, описание, функция). Новые миграции добавляются в конец.
+MIGRATIONS = [
+    (1, "исходная схема", _create_tables),
+    (2, "индексы completed_tasks, active_tasks и employees", _add_indexes),
+    (3, "целочисленные метки времени в active_tasks и completed_tasks", _integer_timestamps),
+    (4, "суточные сводки daily_employee_stats, daily_task_stats и daily_category_stats", _daily_rollups),
+    (5, "итоги сотрудников employee_summary и employee_category_summary", _employee_summaries),
+    (6, "скетчи времени выполнения задач и сотрудников", _duration_sketches),
+    (7, "индекс истории задач сотрудника по задаче", _history_task_index),
+    (8, "AUTOINCREMENT для id выполненных задач", _completed_tasks_autoincrement),
+    (9, "очередь уведомлений notification_outbox", _notification_outbox),
+    (10, "рассылки broadcasts", _broadcasts),
+    (11, "состояние бота persistence_data и persistence_conversations", _persistence_tables),
+]
+
+
+# Архив 1: выполненные задачи, перенесённые из основной базы (см. queries.archive_day).
+# Столбцы как у completed_tasks; внешних ключей нет - между базами они не работают.
+def _archive_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS archive.completed_tasks (
+        id INTEGER PRIMARY KEY,
+        employee_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        points_earned INTEGER NOT NULL,
+        duration_seconds REAL NOT NULL,
+        weekday INTEGER GENERATED ALWAYS AS (CAST(strftime('%w', end_time, 'unixepoch') AS INTEGER)) VIRTUAL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_completed_tasks_end_time ON completed_tasks (end_time)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_completed_tasks_employee_end_time "
+        "ON completed_tasks (employee_id, end_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_completed_tasks_task_end_time "
+        "ON completed_tasks (task_id, end_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_completed_tasks_employee_task_end_time "
+        "ON completed_tasks (employee_id, task_id, end_time)"
+    )
+
+
+# Миграции архивной базы
+ARCHIVE_MIGRATIONS = [
+    (1, "архив выполненных задач", _archive_tables),
+]
+
+
+# Текущая версия схемы (schema - 'main' или 'archive')
+def get_schema_version(conn, schema='main'):
+    return conn.execute(f"PRAGMA {schema}.user_version").fetchone()[0]
+
+
+def _apply(conn, migrations, schema):
+    current_version = get_schema_version(conn, schema)
+
+    for version, description, migration in migrations:
+        if version <= current_version:
+            continue
+
+        logger.info(f"Применение миграции {schema} {version}: {description}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA {schema}.user_version = {version}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        current_version = version
+
+    return current_version
+
+
+# Применение всех недостающих миграций архивной и основной базы.
+# Возвращает версию схемы основной базы.
+def migrate(conn):
+    # Временное представление all_completed_tasks (см. database) ссылается на completed_tasks;
+    # без старого режима ALTER TABLE не даст переименовать таблицу при её пересоздании
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        _apply(conn, ARCHIVE_MIGRATIONS, 'archive')
+        return _apply(conn, MIGRATIONS, 'main')
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
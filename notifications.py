@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import database
+import queries
+
+logger = logging.getLogger(__name__)
+
+# Фоновая отправка уведомлений сотрудникам из очереди notification_outbox.
+# Обработчики ставят уведомление в очередь в той же транзакции, что и изменение
+# (см. queries.enqueue_notification), и сразу отвечают администратору; отправкой
+# занимается NotificationSender. Неудачные попытки повторяются с нарастающей паузой,
+# скорость отправки ограничена общим лимитом бота и лимитом на один чат.
+# Через ту же очередь идут рассылки администраторов (queries.create_broadcast): когда
+# последнее сообщение рассылки доставлено или признано недоставляемым, администратору
+# ставится в очередь отчёт об итогах.
+# Доставка "хотя бы один раз": если бот остановится между отправкой и отметкой
+# об отправке, уведомление после перезапуска уйдёт повторно.
+
+# Не больше стольких сообщений в секунду всего (лимит Telegram - около 30)
+NOTIFY_GLOBAL_RATE = 25
+# Не чаще одного сообщения в один чат за столько секунд
+NOTIFY_PER_CHAT_INTERVAL = 1.0
+# Пауза перед повторной попыткой: NOTIFY_RETRY_BASE * 2^(попытка - 1), не больше NOTIFY_RETRY_MAX
+NOTIFY_RETRY_BASE = 5
+NOTIFY_RETRY_MAX = 3600
+# После стольких неудачных попыток уведомление помечается как неотправляемое
+NOTIFY_MAX_ATTEMPTS = 10
+# Сколько уведомлений читается из очереди за раз
+NOTIFY_BATCH_SIZE = 50
+# Как часто проверять очередь, если новых уведомлений не ставили, секунды
+NOTIFY_POLL_INTERVAL = 30
+# Сколько недоставленных получателей перечислять в отчёте о рассылке
+BROADCAST_REPORT_FAILURES = 20
+
+
+# Пауза перед следующей попыткой после attempts неудачных, секунды
+def retry_delay(attempts):
+    return min(NOTIFY_RETRY_BASE * 2 ** (attempts - 1), NOTIFY_RETRY_MAX)
+
+
+def _seconds(retry_after):
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+class NotificationSender:
+    def __init__(self):
+        self._bot = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        # Когда можно отправить следующее сообщение: всего и в каждый чат (time.monotonic)
+        self._next_send_at = 0.0
+        self._chat_next_send_at = {}
+
+    # Запуск отправки в фоне (вызывается при запуске бота)
+    def start(self, bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run(), name="notification_sender")
+
+    # Остановка отправки; неотправленные уведомления остаются в очереди
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # Сигнал, что в очередь поставлены новые уведомления
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                delay = await self._send_due()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомлений: {e}")
+                delay = NOTIFY_POLL_INTERVAL
+
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+    # Отправка уведомлений, которым пора уйти. Возвращает, через сколько секунд
+    # проверить очередь снова (0 - сразу).
+    async def _send_due(self):
+        now = database.now_timestamp()
+        due = await database.run_read(queries.get_due_notifications, now, NOTIFY_BATCH_SIZE)
+        if not due:
+            next_time = await database.run_read(queries.get_next_notification_time)
+            if next_time is None:
+                return NOTIFY_POLL_INTERVAL
+            return min(max(next_time - now, 1), NOTIFY_POLL_INTERVAL)
+
+        sent = 0
+        chat_wait = None
+        for notification_id, chat_id, text, attempts in due:
+            # Чат получил сообщение только что - уведомление подождёт следующего прохода
+            chat_ready_in = self._chat_next_send_at.get(chat_id, 0.0) - time.monotonic()
+            if chat_ready_in > 0:
+                chat_wait = chat_ready_in if chat_wait is None else min(chat_wait, chat_ready_in)
+                continue
+
+            await asyncio.sleep(max(self._next_send_at - time.monotonic(), 0))
+            self._next_send_at = time.monotonic() + 1 / NOTIFY_GLOBAL_RATE
+            self._chat_next_send_at[chat_id] = time.monotonic() + NOTIFY_PER_CHAT_INTERVAL
+            await self._send(notification_id, chat_id, text, attempts)
+            sent += 1
+
+        # Забываем чаты, которым уже можно писать
+        now_monotonic = time.monotonic()
+        for chat_id in [c for c, at in self._chat_next_send_at.items() if at <= now_monotonic]:
+            del self._chat_next_send_at[chat_id]
+
+        if sent:
+            return 0
+        return chat_wait or 0
+
+    # Отчёт администратору об итогах рассылки (через ту же очередь)
+    async def _report_broadcast(self, broadcast):
+        broadcast_id, admin_chat_id, total, sent, failed = broadcast
+        text = f"📣 Рассылка #{broadcast_id} завершена: доставлено {sent} из {total}."
+        if failed:
+            failures = await database.run_read(queries.get_broadcast_failures, broadcast_id)
+            text += f"\nНе доставлено: {failed}"
+            for recipient, error in failures[:BROADCAST_REPORT_FAILURES]:
+                text += f"\n• {recipient}: {error}"
+            if len(failures) > BROADCAST_REPORT_FAILURES:
+                text += f"\n... и ещё {len(failures) - BROADCAST_REPORT_FAILURES}"
+
+        await database.run_write(queries.enqueue_notification, admin_chat_id, text, database.now_timestamp())
+        logger.info(f"Рассылка {broadcast_id} завершена: доставлено {sent} из {total}, не доставлено {failed}")
+
+    async def _send(self, notification_id, chat_id, text, attempts):
+        broadcast = None
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as e:
+            # Telegram просит подождать: ждём всей отправкой, попытка не считается
+            retry_after = _seconds(e.retry_after)
+            logger.warning(f"Ограничение скорости Telegram, отправка уведомлений приостановлена на {retry_after} с")
+            self._next_send_at = time.monotonic() + retry_after
+            await database.run_write(
+                queries.reschedule_notification, notification_id,
+                database.now_timestamp() + int(retry_after) + 1, None, False
+            )
+        except (Forbidden, BadRequest) as e:
+            # Бот заблокирован или чат не существует - повтор не поможет
+            logger.warning(f"Уведомление {notification_id} в чат {chat_id} не доставлено: {e}")
+            broadcast = await database.run_write(queries.mark_notification_failed, notification_id, str(e))
+        except TelegramError as e:
+            attempts += 1
+            if attempts >= NOTIFY_MAX_ATTEMPTS:
+                logger.error(f"Уведомление {notification_id} в чат {chat_id} не доставлено после {attempts} попыток: {e}")
+                broadcast = await database.run_write(queries.mark_notification_failed, notification_id, str(e))
+            else:
+                logger.warning(f"Не удалось отправить уведомление {notification_id}, попытка {attempts}: {e}")
+                await database.run_write(
+                    queries.reschedule_notification, notification_id,
+                    database.now_timestamp() + retry_delay(attempts), str(e)
+                )
+        else:
+            broadcast = await database.run_write(queries.mark_notification_sent, notification_id)
+
+        if broadcast:
+            await self._report_broadcast(broadcast)
+
+
+sender = NotificationSender()
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Хранение состояния бота (состояния ConversationHandler, user_data, chat_data, bot_data)
+# в SQLite вместо файла PicklePersistence. Каждый ключ user_data/chat_data/bot_data -
+# отдельная строка (значение сериализуется pickle), состояние разговора - строка
+# на ключ разговора. В памяти хранится снимок сохранённых значений, и при обновлении
+# записываются только изменившиеся ключи, поэтому время сохранения зависит от числа
+# изменений, а не от числа пользователей.
+# Загрузка выполняется при запуске бота, запись - через поток записи базы (database.run_write).
+
+# Файл PicklePersistence, который использовался раньше; его содержимое переносится
+# в базу при первом запуске (см. import_pickle)
+PICKLE_PATH = "shoeshop_bot_data.pickle"
+
+# Владелец строк bot_data (у данных бота нет ID)
+_BOT_OWNER = 0
+
+
+def _dump(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _conversation_key(key):
+    return json.dumps(list(key))
+
+
+# Строки данных вида kind ('user', 'chat' или 'bot'): {владелец: {ключ: значение}} в сериализованном виде
+def _load_data(conn, kind):
+    cursor = conn.execute("SELECT owner_id, key, value FROM persistence_data WHERE kind = ?", (kind,))
+    data = {}
+    for owner_id, key, value in cursor:
+        data.setdefault(owner_id, {})[key] = value
+    return data
+
+
+# Запись изменившихся ключей владельца: changed - [(ключ, значение)], removed - [ключ]
+def _save_data(conn, kind, owner_id, changed, removed):
+    conn.executemany("""
+        INSERT INTO persistence_data (kind, owner_id, key, value)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO UPDATE SET value = excluded.value
+    """, [(kind, owner_id, key, value) for key, value in changed])
+    conn.executemany(
+        "DELETE FROM persistence_data WHERE kind = ? AND owner_id = ? AND key = ?",
+        [(kind, owner_id, key) for key in removed]
+    )
+
+
+def _drop_data(conn, kind, owner_id):
+    conn.execute("DELETE FROM persistence_data WHERE kind = ? AND owner_id = ?", (kind, owner_id))
+
+
+def _load_conversations(conn, name):
+    cursor = conn.execute("SELECT key, state FROM persistence_conversations WHERE name = ?", (name,))
+    return cursor.fetchall()
+
+
+# Запись состояния разговора; state=None - разговор завершён
+def _save_conversation(conn, name, key, state):
+    if state is None:
+        conn.execute("DELETE FROM persistence_conversations WHERE name = ? AND key = ?", (name, key))
+    else:
+        conn.execute("""
+            INSERT INTO persistence_conversations (name, key, state)
+            VALUES (?, ?, ?)
+            ON CONFLICT DO UPDATE SET state = excluded.state
+        """, (name, key, state))
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=60):
+        # Произвольные callback_data бот не использует
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        # Сохранённые в базе значения: kind -> {владелец: {ключ: значение}} (сериализованные)
+        self._stored = {}
+        # Сохранённые состояния разговоров: имя -> {ключ: состояние} (сериализованные)
+        self._stored_conversations = {}
+
+    async def _get_data(self, kind):
+        stored = await database.run_read(_load_data, kind)
+        self._stored[kind] = stored
+        return {
+            owner_id: {pickle.loads(key): pickle.loads(value) for key, value in rows.items()}
+            for owner_id, rows in stored.items()
+        }
+
+    async def _update_data(self, kind, owner_id, data):
+        new = {_dump(key): _dump(value) for key, value in data.items()}
+        old = self._stored.setdefault(kind, {}).get(owner_id, {})
+
+        changed = [(key, value) for key, value in new.items() if old.get(key) != value]
+        removed = [key for key in old if key not in new]
+        if changed or removed:
+            await database.run_write(_save_data, kind, owner_id, changed, removed)
+        self._stored[kind][owner_id] = new
+
+    async def _drop_data(self, kind, owner_id):
+        await database.run_write(_drop_data, kind, owner_id)
+        self._stored.setdefault(kind, {}).pop(owner_id, None)
+
+    async def get_user_data(self):
+        return await self._get_data('user')
+
+    async def get_chat_data(self):
+        return await self._get_data('chat')
+
+    async def get_bot_data(self):
+        data = await self._get_data('bot')
+        return data.get(_BOT_OWNER, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await database.run_read(_load_conversations, name)
+        self._stored_conversations[name] = dict(rows)
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        key = _conversation_key(key)
+        state = None if new_state is None else _dump(new_state)
+        stored = self._stored_conversations.setdefault(name, {})
+        if stored.get(key) == state:
+            return
+
+        await database.run_write(_save_conversation, name, key, state)
+        if state is None:
+            stored.pop(key, None)
+        else:
+            stored[key] = state
+
+    async def update_user_data(self, user_id, data):
+        await self._update_data('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._update_data('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        await self._update_data('bot', _BOT_OWNER, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._drop_data('user', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._drop_data('chat', chat_id)
+
+    # Данные в памяти бота всегда актуальны - перечитывать нечего
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Изменения записываются сразу в update_*, отложенных записей нет
+    async def flush(self):
+        pass
+
+
+# PicklePersistence заменяет ссылки на объект бота метками (persistent id);
+# при переносе они становятся None
+class _PickleFileUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return None
+
+
+# Перенос данных из файла PicklePersistence в базу (вызывается при запуске до создания
+# приложения). После переноса файл переименовывается в *.migrated, чтобы не переносить
+# его повторно; если бот остановится до переименования, повторный перенос перезапишет
+# те же строки.
+def import_pickle(conn, path=PICKLE_PATH):
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as file:
+        data = _PickleFileUnpickler(file).load()
+
+    rows = []
+    for kind, key in (('user', 'user_data'), ('chat', 'chat_data')):
+        for owner_id, values in (data.get(key) or {}).items():
+            rows.extend((kind, owner_id, _dump(k), _dump(v)) for k, v in values.items())
+    rows.extend(('bot', _BOT_OWNER, _dump(k), _dump(v)) for k, v in (data.get('bot_data') or {}).items())
+
+    conversations = [
+        (name, _conversation_key(key), _dump(state))
+        for name, states in (data.get('conversations') or {}).items()
+        for key, state in states.items()
+        if state is not None
+    ]
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("""
+            INSERT INTO persistence_data (kind, owner_id, key, value)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT DO UPDATE SET value = excluded.value
+        """, rows)
+        conn.executemany("""
+            INSERT INTO persistence_conversations (name, key, state)
+            VALUES (?, ?, ?)
+            ON CONFLICT DO UPDATE SET state = excluded.state
+        """, conversations)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+    os.replace(path, path + ".migrated")
+    logger.info(
+        f"Данные {path} перенесены в базу: {len(rows)} значений, {len(conversations)} состояний разговоров"
+    )
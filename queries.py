@@ -0,0 +1,1048 @@
+# Запросы к базе данных.
+# Каждая функция принимает соединение первым аргументом и вызывается через
+# database.run_read / database.run_write, чтобы не блокировать цикл событий.
+
+import sketches
+
+
+# Сотрудник, к которому привязан Telegram ID (включая неактивных): (id, name, active)
+def get_employee_identity(conn, telegram_id):
+    cursor = conn.execute("SELECT id, name, active FROM employees WHERE telegram_id = ?", (telegram_id,))
+    return cursor.fetchone()
+
+
+# Получение имени, статуса и Telegram ID сотрудника
+def get_employee(conn, employee_id):
+    cursor = conn.execute("SELECT name, active, telegram_id FROM employees WHERE id = ?", (employee_id,))
+    return cursor.fetchone()
+
+
+# Список активных сотрудников
+def get_active_employees(conn):
+    cursor = conn.execute("SELECT id, name FROM employees WHERE active = 1 ORDER BY name")
+    return cursor.fetchall()
+
+
+# Список активных сотрудников с зарплатой
+def get_active_employees_with_salary(conn):
+    cursor = conn.execute("SELECT id, name, salary FROM employees WHERE active = 1 ORDER BY name")
+    return cursor.fetchall()
+
+
+# Добавление сотрудника
+def add_employee(conn, name, salary):
+    cursor = conn.execute(
+        "INSERT INTO employees (name, salary, active) VALUES (?, ?, 1)",
+        (name, salary)
+    )
+    return cursor.lastrowid
+
+
+# Привязка Telegram ID к сотруднику
+def bind_telegram_id(conn, employee_id, telegram_id):
+    conn.execute(
+        "UPDATE employees SET telegram_id = ? WHERE id = ?",
+        (telegram_id, employee_id)
+    )
+
+
+# Изменение имени сотрудника
+def update_employee_name(conn, employee_id, name):
+    conn.execute("UPDATE employees SET name = ? WHERE id = ?", (name, employee_id))
+
+
+# Изменение зарплаты сотрудника
+def update_employee_salary(conn, employee_id, salary):
+    conn.execute("UPDATE employees SET salary = ? WHERE id = ?", (salary, employee_id))
+
+
+# Деактивация сотрудника
+def deactivate_employee(conn, employee_id):
+    conn.execute("UPDATE employees SET active = 0 WHERE id = ?", (employee_id,))
+
+
+# Список всех задач, упорядоченный по категориям
+def get_tasks(conn):
+    cursor = conn.execute("SELECT id, name, points, category FROM tasks ORDER BY category, name")
+    return cursor.fetchall()
+
+
+# Получение названия и очков задачи
+def get_task(conn, task_id):
+    cursor = conn.execute("SELECT name, points FROM tasks WHERE id = ?", (task_id,))
+    return cursor.fetchone()
+
+
+# Добавление задачи
+def add_task(conn, name, points, category):
+    conn.execute(
+        "INSERT INTO tasks (name, points, category) VALUES (?, ?, ?)",
+        (name, points, category)
+    )
+
+
+# Изменение названия задачи
+def update_task_name(conn, task_id, name):
+    conn.execute("UPDATE tasks SET name = ? WHERE id = ?", (name, task_id))
+
+
+# Изменение очков задачи
+def update_task_points(conn, task_id, points):
+    conn.execute("UPDATE tasks SET points = ? WHERE id = ?", (points, task_id))
+
+
+# Изменение категории задачи
+def update_task_category(conn, task_id, category):
+    old_category = _get_task_category(conn, task_id)
+    completions = _get_task_completions(conn, task_id)
+    conn.execute("UPDATE tasks SET category = ? WHERE id = ?", (category, task_id))
+    # Выполненные задачи учитываются в текущей категории задачи
+    if old_category is not None and old_category != category:
+        _recount_daily_category_stats(conn, completions, (old_category, category))
+        _move_employee_category_summary(conn, completions, old_category, category)
+
+
+# Удаление задачи
+def delete_task(conn, task_id):
+    old_category = _get_task_category(conn, task_id)
+    completions = _get_task_completions(conn, task_id)
+    conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+    # Задачи, которых нет в справочнике, не попадают в статистику по категориям
+    if old_category is not None:
+        _recount_daily_category_stats(conn, completions, (old_category,))
+        _move_employee_category_summary(conn, completions, old_category, None)
+
+
+def _get_task_category(conn, task_id):
+    row = conn.execute("SELECT category FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    return row[0] if row else None
+
+
+# Выполненные задачи task_id по дням и сотрудникам, включая архив:
+# [(день, сотрудник, количество, очки)]
+def _get_task_completions(conn, task_id):
+    cursor = conn.execute("""
+        SELECT end_time / 86400, employee_id, COUNT(*), SUM(points_earned)
+        FROM all_completed_tasks
+        WHERE task_id = ?
+        GROUP BY end_time / 86400, employee_id
+    """, (task_id,))
+    return cursor.fetchall()
+
+
+# Количество активных задач сотрудника
+def count_active_tasks(conn, employee_id):
+    cursor = conn.execute("SELECT COUNT(*) FROM active_tasks WHERE employee_id = ?", (employee_id,))
+    return cursor.fetchone()[0]
+
+
+# Количество активных задач данного типа
+def count_active_tasks_for_task(conn, task_id):
+    cursor = conn.execute("SELECT COUNT(*) FROM active_tasks WHERE task_id = ?", (task_id,))
+    return cursor.fetchone()[0]
+
+
+# Активные задачи сотрудника
+def get_employee_active_tasks(conn, employee_id):
+    cursor = conn.execute("""
+        SELECT a.id, t.name, t.points, a.start_time
+        FROM active_tasks a
+        JOIN tasks t ON a.task_id = t.id
+        WHERE a.employee_id = ?
+    """, (employee_id,))
+    return cursor.fetchall()
+
+
+# Активные задачи всех сотрудников
+def get_all_active_tasks(conn):
+    cursor = conn.execute("""
+        SELECT a.id, e.name as employee_name, t.name as task_name, a.start_time
+        FROM active_tasks a
+        JOIN employees e ON a.employee_id = e.id
+        JOIN tasks t ON a.task_id = t.id
+        ORDER BY e.name, a.start_time
+    """)
+    return cursor.fetchall()
+
+
+# Взятие задачи в работу
+def start_task(conn, employee_id, task_id, start_time):
+    conn.execute(
+        "INSERT INTO active_tasks (employee_id, task_id, start_time) VALUES (?, ?, ?)",
+        (employee_id, task_id, start_time)
+    )
+
+
+# Назначение задачи сотруднику. Если у сотрудника есть привязанный Telegram,
+# в той же транзакции ставится в очередь уведомление notification.
+# Возвращает Telegram ID сотрудника.
+def assign_task(conn, employee_id, task_id, start_time, notification):
+    start_task(conn, employee_id, task_id, start_time)
+    cursor = conn.execute("SELECT telegram_id FROM employees WHERE id = ?", (employee_id,))
+    telegram_id = cursor.fetchone()[0]
+    if telegram_id:
+        enqueue_notification(conn, telegram_id, notification, start_time)
+    return telegram_id
+
+
+# Результаты взятия задачи
+TAKE_OK = 'ok'
+TAKE_NOT_FOUND = 'not_found'
+TAKE_ALREADY_TAKEN = 'already_taken'
+TAKE_LIMIT_REACHED = 'limit_reached'
+
+
+# Взятие задачи сотрудником одним запросом: вставка происходит, только если задача
+# существует, ещё не взята этим сотрудником и у него меньше max_active активных задач.
+# Возвращает (результат, название задачи, очки).
+def take_task(conn, employee_id, task_id, start_time, max_active):
+    cursor = conn.execute("""
+        INSERT INTO active_tasks (employee_id, task_id, start_time)
+        SELECT ?, t.id, ?
+        FROM tasks t
+        WHERE t.id = ?
+          AND NOT EXISTS (
+              SELECT 1 FROM active_tasks WHERE employee_id = ? AND task_id = ?
+          )
+          AND (SELECT COUNT(*) FROM active_tasks WHERE employee_id = ?) < ?
+        RETURNING
+            (SELECT name FROM tasks WHERE id = task_id),
+            (SELECT points FROM tasks WHERE id = task_id)
+    """, (employee_id, start_time, task_id, employee_id, task_id, employee_id, max_active))
+    inserted = cursor.fetchone()
+
+    if inserted:
+        task_name, points = inserted
+        return TAKE_OK, task_name, points
+
+    # Вставка не произошла - выясняем причину
+    task_info = get_task(conn, task_id)
+    if not task_info:
+        return TAKE_NOT_FOUND, None, None
+
+    task_name, points = task_info
+    cursor = conn.execute(
+        "SELECT 1 FROM active_tasks WHERE employee_id = ? AND task_id = ?",
+        (employee_id, task_id)
+    )
+    if cursor.fetchone():
+        return TAKE_ALREADY_TAKEN, task_name, points
+    return TAKE_LIMIT_REACHED, task_name, points
+
+
+# Завершение задачи: удаление из активных и запись в выполненные в одной транзакции.
+# Повторное завершение той же задачи ничего не найдёт и вернёт None.
+# Возвращает (название задачи, очки, длительность в секундах).
+def complete_task(conn, active_task_id, employee_id, end_time):
+    cursor = conn.execute("""
+        DELETE FROM active_tasks
+        WHERE id = ? AND employee_id = ?
+        RETURNING task_id, start_time
+    """, (active_task_id, employee_id))
+    deleted = cursor.fetchone()
+
+    if not deleted:
+        return None
+
+    task_id, start_time = deleted
+    cursor = conn.execute("""
+        INSERT INTO completed_tasks
+        (employee_id, task_id, start_time, end_time, points_earned, duration_seconds)
+        SELECT ?, t.id, ?, ?, t.points, ?
+        FROM tasks t
+        WHERE t.id = ?
+        RETURNING
+            (SELECT name FROM tasks WHERE id = task_id),
+            (SELECT category FROM tasks WHERE id = task_id),
+            points_earned,
+            duration_seconds
+    """, (employee_id, start_time, end_time, end_time - start_time, task_id))
+    completed = cursor.fetchone()
+
+    if not completed:
+        # Задачу удалили из справочника - откатываем транзакцию, активная задача останется
+        raise LookupError(f"Задача {task_id} не найдена")
+
+    task_name, category, points, duration_seconds = completed
+    _add_to_rollups(conn, end_time, employee_id, task_id, category, points, duration_seconds)
+
+    return task_name, points, duration_seconds
+
+
+# Отмена активной задачи.
+# Возвращает (имя сотрудника, название задачи, Telegram ID сотрудника) или None.
+def cancel_active_task(conn, active_task_id, notification_template, now):
+    cursor = conn.execute("""
+        DELETE FROM active_tasks
+        WHERE id = ?
+        RETURNING
+            (SELECT name FROM employees WHERE id = employee_id),
+            (SELECT name FROM tasks WHERE id = task_id),
+            (SELECT telegram_id FROM employees WHERE id = employee_id)
+    """, (active_task_id,))
+    task_info = cursor.fetchone()
+
+    # Уведомление сотруднику ставится в очередь в той же транзакции
+    if task_info and task_info[2]:
+        enqueue_notification(conn, task_info[2], notification_template.format(task_name=task_info[1]), now)
+    return task_info
+
+
+# Личная статистика сотрудника: имя, итоги, категории, активные задачи и скетч времени выполнения.
+# Итоги и категории берутся из накопленных счётчиков employee_summary
+# и employee_category_summary, а не считаются по всей истории сотрудника.
+def get_employee_statistics(conn, employee_id):
+    cursor = conn.execute("""
+        SELECT
+            e.name,
+            COALESCE(s.task_count, 0) as total_tasks,
+            s.points as total_points,
+            s.duration_sum / s.task_count / 60.0 as avg_duration,
+            s.duration_sum / 3600.0 as total_duration
+        FROM employees e
+        LEFT JOIN employee_summary s ON s.employee_id = e.id
+        WHERE e.id = ?
+    """, (employee_id,))
+    employee_name, *stats = cursor.fetchone()
+
+    cursor = conn.execute("""
+        SELECT
+            category,
+            task_count as category_count,
+            points as category_points
+        FROM employee_category_summary
+        WHERE employee_id = ?
+        ORDER BY category_points DESC
+    """, (employee_id,))
+    category_stats = cursor.fetchall()
+
+    cursor = conn.execute("""
+        SELECT
+            t.name,
+            t.points,
+            a.start_time
+        FROM active_tasks a
+        JOIN tasks t ON a.task_id = t.id
+        WHERE a.employee_id = ?
+    """, (employee_id,))
+    active_tasks = cursor.fetchall()
+
+    duration_sketch = get_employee_duration_sketch(conn, employee_id)
+
+    return employee_name, tuple(stats), category_stats, active_tasks, duration_sketch
+
+
+# Суточные сводки (daily_employee_stats, daily_task_stats, daily_category_stats).
+# День - номер суток метки времени окончания задачи (end_time // 86400, см. database.to_timestamp).
+# Сводки обновляются в той же транзакции, что и завершение задачи, поэтому отчёты
+# за период суммируют по строке на день вместо перебора всех выполненных задач.
+# Там же обновляются итоги сотрудника за всё время (employee_summary, employee_category_summary).
+SECONDS_PER_DAY = 86400
+
+_ROLLUP_UPSERT = """
+    ON CONFLICT DO UPDATE SET
+        task_count = task_count + 1,
+        points = points + excluded.points,
+        duration_sum = duration_sum + excluded.duration_sum,
+        duration_min = MIN(duration_min, excluded.duration_min),
+        duration_max = MAX(duration_max, excluded.duration_max)
+"""
+
+
+# Учёт одной выполненной задачи в суточных сводках и итогах сотрудника
+def _add_to_rollups(conn, end_time, employee_id, task_id, category, points, duration_seconds):
+    day = end_time // SECONDS_PER_DAY
+    totals = (points, duration_seconds, duration_seconds, duration_seconds)
+
+    conn.execute("""
+        INSERT INTO daily_employee_stats
+        (day, employee_id, task_count, points, duration_sum, duration_min, duration_max)
+        VALUES (?, ?, 1, ?, ?, ?, ?)
+    """ + _ROLLUP_UPSERT, (day, employee_id) + totals)
+    conn.execute("""
+        INSERT INTO daily_task_stats
+        (day, task_id, task_count, points, duration_sum, duration_min, duration_max)
+        VALUES (?, ?, 1, ?, ?, ?, ?)
+    """ + _ROLLUP_UPSERT, (day, task_id) + totals)
+    conn.execute("""
+        INSERT INTO daily_category_stats
+        (day, employee_id, category, task_count, points, duration_sum, duration_min, duration_max)
+        VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+    """ + _ROLLUP_UPSERT, (day, employee_id, category) + totals)
+
+    conn.execute("""
+        INSERT INTO employee_summary (employee_id, task_count, points, duration_sum)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT DO UPDATE SET
+            task_count = task_count + 1,
+            points = points + excluded.points,
+            duration_sum = duration_sum + excluded.duration_sum
+    """, (employee_id, points, duration_seconds))
+    conn.execute("""
+        INSERT INTO employee_category_summary (employee_id, category, task_count, points)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT DO UPDATE SET
+            task_count = task_count + 1,
+            points = points + excluded.points
+    """, (employee_id, category, points))
+
+    _add_to_duration_sketches(conn, day, employee_id, task_id, duration_seconds)
+
+
+def _rebuild_daily_category_stats(conn):
+    conn.execute("DELETE FROM daily_category_stats")
+    conn.execute("""
+        INSERT INTO daily_category_stats
+        (day, employee_id, category, task_count, points, duration_sum, duration_min, duration_max)
+        SELECT
+            c.end_time / 86400,
+            c.employee_id,
+            t.category,
+            COUNT(*),
+            SUM(c.points_earned),
+            SUM(c.duration_seconds),
+            MIN(c.duration_seconds),
+            MAX(c.duration_seconds)
+        FROM all_completed_tasks c
+        JOIN tasks t ON c.task_id = t.id
+        GROUP BY c.end_time / 86400, c.employee_id, t.category
+    """)
+
+
+# Пересчёт строк суточных сводок по категориям categories для дней и сотрудников
+# из completions (см. _get_task_completions). После изменения категории или удаления
+# задачи меняются только строки тех дней, в которые она выполнялась, поэтому
+# вся история не перечитывается.
+def _recount_daily_category_stats(conn, completions, categories):
+    placeholders = ", ".join("?" * len(categories))
+    for day, employee_id, _, _ in completions:
+        conn.execute(f"""
+            DELETE FROM daily_category_stats
+            WHERE day = ? AND employee_id = ? AND category IN ({placeholders})
+        """, (day, employee_id, *categories))
+        conn.execute(f"""
+            INSERT INTO daily_category_stats
+            (day, employee_id, category, task_count, points, duration_sum, duration_min, duration_max)
+            SELECT
+                ?,
+                c.employee_id,
+                t.category,
+                COUNT(*),
+                SUM(c.points_earned),
+                SUM(c.duration_seconds),
+                MIN(c.duration_seconds),
+                MAX(c.duration_seconds)
+            FROM all_completed_tasks c
+            JOIN tasks t ON c.task_id = t.id
+            WHERE c.employee_id = ? AND c.end_time >= ? AND c.end_time < ?
+              AND t.category IN ({placeholders})
+            GROUP BY c.employee_id, t.category
+        """, (day, employee_id, day * SECONDS_PER_DAY, (day + 1) * SECONDS_PER_DAY, *categories))
+
+
+# Перенос выполненных задач одной задачи (completions, см. _get_task_completions)
+# из категории old_category в new_category в итогах сотрудников; new_category=None -
+# задача удалена и больше не учитывается
+def _move_employee_category_summary(conn, completions, old_category, new_category):
+    totals = {}
+    for _, employee_id, task_count, points in completions:
+        employee_count, employee_points = totals.get(employee_id, (0, 0))
+        totals[employee_id] = (employee_count + task_count, employee_points + points)
+
+    for employee_id, (task_count, points) in totals.items():
+        conn.execute("""
+            UPDATE employee_category_summary
+            SET task_count = task_count - ?, points = points - ?
+            WHERE employee_id = ? AND category = ?
+        """, (task_count, points, employee_id, old_category))
+        conn.execute("""
+            DELETE FROM employee_category_summary
+            WHERE employee_id = ? AND category = ? AND task_count <= 0
+        """, (employee_id, old_category))
+        if new_category is not None:
+            conn.execute("""
+                INSERT INTO employee_category_summary (employee_id, category, task_count, points)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO UPDATE SET
+                    task_count = task_count + excluded.task_count,
+                    points = points + excluded.points
+            """, (employee_id, new_category, task_count, points))
+
+
+# Итоги сотрудников по категориям пересчитываются из суточных сводок по категориям
+def _rebuild_employee_category_summary(conn):
+    conn.execute("DELETE FROM employee_category_summary")
+    conn.execute("""
+        INSERT INTO employee_category_summary (employee_id, category, task_count, points)
+        SELECT employee_id, category, SUM(task_count), SUM(points)
+        FROM daily_category_stats
+        GROUP BY employee_id, category
+    """)
+
+
+# Полный пересчёт суточных сводок по всем выполненным задачам, включая архив
+def rebuild_daily_rollups(conn):
+    conn.execute("DELETE FROM daily_employee_stats")
+    conn.execute("""
+        INSERT INTO daily_employee_stats
+        (day, employee_id, task_count, points, duration_sum, duration_min, duration_max)
+        SELECT
+            end_time / 86400,
+            employee_id,
+            COUNT(*),
+            SUM(points_earned),
+            SUM(duration_seconds),
+            MIN(duration_seconds),
+            MAX(duration_seconds)
+        FROM all_completed_tasks
+        GROUP BY end_time / 86400, employee_id
+    """)
+
+    conn.execute("DELETE FROM daily_task_stats")
+    conn.execute("""
+        INSERT INTO daily_task_stats
+        (day, task_id, task_count, points, duration_sum, duration_min, duration_max)
+        SELECT
+            end_time / 86400,
+            task_id,
+            COUNT(*),
+            SUM(points_earned),
+            SUM(duration_seconds),
+            MIN(duration_seconds),
+            MAX(duration_seconds)
+        FROM all_completed_tasks
+        GROUP BY end_time / 86400, task_id
+    """)
+
+    _rebuild_daily_category_stats(conn)
+
+
+# Полный пересчёт итогов сотрудников за всё время по суточным сводкам
+def rebuild_employee_summaries(conn):
+    conn.execute("DELETE FROM employee_summary")
+    conn.execute("""
+        INSERT INTO employee_summary (employee_id, task_count, points, duration_sum)
+        SELECT employee_id, SUM(task_count), SUM(points), SUM(duration_sum)
+        FROM daily_employee_stats
+        GROUP BY employee_id
+    """)
+
+    _rebuild_employee_category_summary(conn)
+
+
+# Скетчи времени выполнения (см. sketches): счётчики корзин по задачам за каждый день
+# (для квантилей за период), по задачам и по сотрудникам за всё время
+def _add_to_duration_sketches(conn, day, employee_id, task_id, duration_seconds):
+    bucket = sketches.bucket_index(duration_seconds)
+
+    conn.execute("""
+        INSERT INTO daily_task_duration_sketch (day, task_id, bucket, count)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1
+    """, (day, task_id, bucket))
+    conn.execute("""
+        INSERT INTO task_duration_sketch (task_id, bucket, count)
+        VALUES (?, ?, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1
+    """, (task_id, bucket))
+    conn.execute("""
+        INSERT INTO employee_duration_sketch (employee_id, bucket, count)
+        VALUES (?, ?, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1
+    """, (employee_id, bucket))
+
+
+# Полный пересчёт скетчей времени выполнения по всем выполненным задачам, включая архив
+def rebuild_duration_sketches(conn):
+    daily_task = {}
+    task = {}
+    employee = {}
+
+    cursor = conn.execute("SELECT end_time, employee_id, task_id, duration_seconds FROM all_completed_tasks")
+    for end_time, employee_id, task_id, duration_seconds in cursor:
+        bucket = sketches.bucket_index(duration_seconds)
+        for counts, key in (
+            (daily_task, (end_time // SECONDS_PER_DAY, task_id, bucket)),
+            (task, (task_id, bucket)),
+            (employee, (employee_id, bucket)),
+        ):
+            counts[key] = counts.get(key, 0) + 1
+
+    conn.execute("DELETE FROM daily_task_duration_sketch")
+    conn.executemany(
+        "INSERT INTO daily_task_duration_sketch (day, task_id, bucket, count) VALUES (?, ?, ?, ?)",
+        [key + (count,) for key, count in daily_task.items()]
+    )
+    conn.execute("DELETE FROM task_duration_sketch")
+    conn.executemany(
+        "INSERT INTO task_duration_sketch (task_id, bucket, count) VALUES (?, ?, ?)",
+        [key + (count,) for key, count in task.items()]
+    )
+    conn.execute("DELETE FROM employee_duration_sketch")
+    conn.executemany(
+        "INSERT INTO employee_duration_sketch (employee_id, bucket, count) VALUES (?, ?, ?)",
+        [key + (count,) for key, count in employee.items()]
+    )
+
+
+# Полный пересчёт всех сводок (первичное заполнение или восстановление после
+# ручной правки базы). Возвращает количество учтённых выполненных задач.
+def rebuild_rollups(conn):
+    rebuild_daily_rollups(conn)
+    rebuild_employee_summaries(conn)
+    rebuild_duration_sketches(conn)
+
+    cursor = conn.execute("SELECT COUNT(*) FROM all_completed_tasks")
+    return cursor.fetchone()[0]
+
+
+# Конец открытого периода ("по настоящее время")
+_END_OF_TIME = 2 ** 53
+
+
+# Параметры периода [start_date, end_date) для отчётов по сводкам: целые сутки
+# [first_day, end_day) берутся из сводок, а неполные сутки в начале [head_start, head_end)
+# и в конце [tail_start, tail_end) - из выполненных задач
+def _period_bounds(start_date, end_date=None):
+    if end_date is None:
+        end_date = _END_OF_TIME
+
+    first_day = -(-start_date // SECONDS_PER_DAY)
+    end_day = end_date // SECONDS_PER_DAY
+
+    if first_day < end_day:
+        return {
+            'first_day': first_day, 'end_day': end_day,
+            'head_start': start_date, 'head_end': first_day * SECONDS_PER_DAY,
+            'tail_start': end_day * SECONDS_PER_DAY, 'tail_end': end_date,
+        }
+
+    # Период короче целых суток - только выполненные задачи
+    return {
+        'first_day': 0, 'end_day': 0,
+        'head_start': start_date, 'head_end': end_date,
+        'tail_start': 0, 'tail_end': 0,
+    }
+
+
+# Общее табличное выражение period: строки сводки rollup_table за целые сутки периода
+# и отдельные выполненные задачи (all_completed_tasks c, включая архив) за неполные сутки.
+# Столбцы rollup_columns и raw_columns должны совпадать по смыслу и порядку.
+def _period_cte(rollup_table, rollup_columns, raw_columns, raw_join=""):
+    raw_select = f"SELECT {raw_columns} FROM all_completed_tasks c {raw_join}"
+    return f"""
+        WITH period AS (
+            SELECT {rollup_columns}
+            FROM {rollup_table}
+            WHERE day >= :first_day AND day < :end_day
+            UNION ALL
+            {raw_select}
+            WHERE c.end_time >= :head_start AND c.end_time < :head_end
+            UNION ALL
+            {raw_select}
+            WHERE c.end_time >= :tail_start AND c.end_time < :tail_end
+        )
+    """
+
+
+_EMPLOYEE_PERIOD = _period_cte(
+    "daily_employee_stats",
+    "employee_id, task_count, points, duration_sum",
+    "c.employee_id, 1, c.points_earned, c.duration_seconds",
+)
+
+
+# Аналитика по сотрудникам за период [start_date, end_date) (метки времени, см. database.to_timestamp;
+# end_date=None - по настоящее время)
+def get_employee_analytics(conn, start_date, end_date=None, show_all=False):
+    query = _EMPLOYEE_PERIOD + """
+        SELECT
+            e.id,
+            e.name,
+            COALESCE(SUM(p.task_count), 0) as completed_count,
+            SUM(p.points) as total_points,
+            SUM(p.duration_sum) / SUM(p.task_count) / 60.0 as avg_duration,
+            SUM(p.duration_sum) / 3600.0 as total_hours,
+            e.salary,
+            e.active
+        FROM employees e
+        LEFT JOIN period p ON e.id = p.employee_id
+    """
+
+    if not show_all:
+        query += " WHERE e.active = 1"
+
+    query += " GROUP BY e.id ORDER BY total_points DESC"
+
+    cursor = conn.execute(query, _period_bounds(start_date, end_date))
+    return cursor.fetchall()
+
+
+# Аналитика по задачам за период [start_date, end_date)
+def get_task_analytics(conn, start_date, end_date=None):
+    query = _period_cte(
+        "daily_task_stats",
+        "task_id, task_count, duration_sum",
+        "c.task_id, 1, c.duration_seconds",
+    ) + """
+        SELECT
+            t.id,
+            t.name,
+            t.category,
+            COALESCE(SUM(p.task_count), 0) as completed_count,
+            SUM(p.duration_sum) / SUM(p.task_count) / 60.0 as avg_duration,
+            t.points
+        FROM tasks t
+        LEFT JOIN period p ON t.id = p.task_id
+        GROUP BY t.id
+        ORDER BY completed_count DESC
+    """
+    cursor = conn.execute(query, _period_bounds(start_date, end_date))
+    return cursor.fetchall()
+
+
+# Общая статистика, статистика по категориям и по дням недели за период [start_date, end_date)
+def get_general_analytics(conn, start_date, end_date=None):
+    bounds = _period_bounds(start_date, end_date)
+
+    cursor = conn.execute(_EMPLOYEE_PERIOD + """
+        SELECT
+            COUNT(DISTINCT p.employee_id) as active_employees,
+            COALESCE(SUM(p.task_count), 0) as total_completed,
+            SUM(p.points) as total_points,
+            SUM(p.duration_sum) / SUM(p.task_count) / 60.0 as avg_task_duration,
+            SUM(p.duration_sum) / 3600.0 as total_hours
+        FROM period p
+        JOIN employees e ON p.employee_id = e.id
+        WHERE e.active = 1
+    """, bounds)
+    general_stats = cursor.fetchone()
+
+    cursor = conn.execute(_period_cte(
+        "daily_category_stats",
+        "employee_id, category, task_count, points, duration_sum",
+        "c.employee_id, t.category, 1, c.points_earned, c.duration_seconds",
+        "JOIN tasks t ON c.task_id = t.id",
+    ) + """
+        SELECT
+            p.category,
+            SUM(p.task_count) as category_count,
+            SUM(p.points) as category_points,
+            SUM(p.duration_sum) / SUM(p.task_count) / 60.0 as category_avg_duration
+        FROM period p
+        JOIN employees e ON p.employee_id = e.id
+        WHERE e.active = 1
+        GROUP BY p.category
+        ORDER BY category_points DESC
+    """, bounds)
+    category_stats = cursor.fetchall()
+
+    cursor = conn.execute(_period_cte(
+        "daily_employee_stats",
+        "employee_id, CAST(strftime('%w', day * 86400, 'unixepoch') AS INTEGER) as weekday, task_count, points",
+        "c.employee_id, c.weekday, 1, c.points_earned",
+    ) + """
+        SELECT
+            p.weekday as day_of_week,
+            SUM(p.task_count) as day_count,
+            SUM(p.points) as day_points
+        FROM period p
+        JOIN employees e ON p.employee_id = e.id
+        WHERE e.active = 1
+        GROUP BY day_of_week
+        ORDER BY day_of_week
+    """, bounds)
+    day_stats = cursor.fetchall()
+
+    return general_stats, category_stats, day_stats
+
+
+# Скетчи времени выполнения по задачам за период [start_date, end_date): {task_id: DurationSketch}.
+# Если период охватывает всю историю, берутся скетчи за всё время, иначе складываются
+# дневные скетчи за целые сутки и добавляются задачи неполных суток.
+def get_task_duration_sketches(conn, start_date, end_date=None):
+    task_sketches = {}
+
+    def sketch_for(task_id):
+        if task_id not in task_sketches:
+            task_sketches[task_id] = sketches.DurationSketch()
+        return task_sketches[task_id]
+
+    # Минимум по каждой таблице отдельно: так каждый берётся из индекса по end_time
+    first_end_time = conn.execute("""
+        SELECT MIN(first_end_time) FROM (
+            SELECT MIN(end_time) AS first_end_time FROM completed_tasks
+            UNION ALL
+            SELECT MIN(end_time) FROM archive.completed_tasks
+        )
+    """).fetchone()[0]
+    if end_date is None and (first_end_time is None or start_date <= first_end_time):
+        cursor = conn.execute("SELECT task_id, bucket, count FROM task_duration_sketch")
+        for task_id, bucket, count in cursor:
+            sketch_for(task_id).add_bucket(bucket, count)
+        return task_sketches
+
+    bounds = _period_bounds(start_date, end_date)
+    cursor = conn.execute("""
+        SELECT task_id, bucket, SUM(count)
+        FROM daily_task_duration_sketch
+        WHERE day >= :first_day AND day < :end_day
+        GROUP BY task_id, bucket
+    """, bounds)
+    for task_id, bucket, count in cursor:
+        sketch_for(task_id).add_bucket(bucket, count)
+
+    cursor = conn.execute("""
+        SELECT task_id, duration_seconds
+        FROM all_completed_tasks
+        WHERE (end_time >= :head_start AND end_time < :head_end)
+           OR (end_time >= :tail_start AND end_time < :tail_end)
+    """, bounds)
+    for task_id, duration_seconds in cursor:
+        sketch_for(task_id).add(duration_seconds)
+
+    return task_sketches
+
+
+# Скетч времени выполнения сотрудника за всё время
+def get_employee_duration_sketch(conn, employee_id):
+    sketch = sketches.DurationSketch()
+    cursor = conn.execute(
+        "SELECT bucket, count FROM employee_duration_sketch WHERE employee_id = ?", (employee_id,)
+    )
+    for bucket, count in cursor:
+        sketch.add_bucket(bucket, count)
+    return sketch
+
+
+# Страница истории выполненных задач сотрудника, от новых к старым.
+# Постраничный переход по ключу (end_time, id) без OFFSET: before - ключ последней строки
+# текущей страницы (следующая, более ранняя страница), after - ключ первой строки
+# (предыдущая, более новая страница). Необязательные фильтры: период [start_date, end_date)
+# и задача. Горячая таблица и архив читаются отдельно (каждая по своему индексу,
+# не больше limit строк), и страница собирается из обеих.
+def get_task_history_page(conn, employee_id, limit, before=None, after=None,
+                          start_date=None, end_date=None, task_id=None):
+    conditions = "c.employee_id = ?"
+    params = [employee_id]
+
+    if task_id is not None:
+        conditions += " AND c.task_id = ?"
+        params.append(task_id)
+    if start_date is not None:
+        conditions += " AND c.end_time >= ?"
+        params.append(start_date)
+    if end_date is not None:
+        conditions += " AND c.end_time < ?"
+        params.append(end_date)
+
+    if after is not None:
+        conditions += " AND (c.end_time, c.id) > (?, ?)"
+        params.extend([after[0], after[1]])
+        order = "ORDER BY c.end_time, c.id LIMIT ?"
+    else:
+        if before is not None:
+            conditions += " AND (c.end_time, c.id) < (?, ?)"
+            params.extend([before[0], before[1]])
+        order = "ORDER BY c.end_time DESC, c.id DESC LIMIT ?"
+    params.append(limit)
+
+    rows = []
+    for table in ("completed_tasks", "archive.completed_tasks"):
+        rows += conn.execute(f"""
+            SELECT
+                c.id,
+                t.name as task_name,
+                c.points_earned,
+                c.start_time,
+                c.end_time,
+                c.duration_seconds / 60.0 as duration_minutes
+            FROM {table} c
+            JOIN tasks t ON c.task_id = t.id
+            WHERE {conditions}
+            {order}
+        """, params).fetchall()
+
+    # after: берём ближайшие более новые строки и возвращаем их от новых к старым
+    rows.sort(key=lambda row: (row[4], row[0]), reverse=after is None)
+    rows = rows[:limit]
+    if after is not None:
+        rows.reverse()
+    return rows
+
+
+# Постановка уведомления в очередь notification_outbox. Вызывается в той же транзакции,
+# что и изменение, о котором сообщает уведомление: оно не потеряется ни при ошибке
+# отправки, ни при перезапуске бота. Отправляет очередь notifications.NotificationSender.
+def enqueue_notification(conn, chat_id, text, now):
+    conn.execute(
+        "INSERT INTO notification_outbox (chat_id, text, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+        (chat_id, text, now, now)
+    )
+
+
+# Уведомления, которые пора отправить: (id, chat_id, text, attempts).
+# Уведомления о задачах идут раньше сообщений рассылок, чтобы большая рассылка их не задерживала.
+def get_due_notifications(conn, now, limit):
+    cursor = conn.execute("""
+        SELECT id, chat_id, text, attempts
+        FROM notification_outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY broadcast_id IS NOT NULL, next_attempt_at, id
+        LIMIT ?
+    """, (now, limit))
+    return cursor.fetchall()
+
+
+# Время следующей запланированной попытки отправки или None, если очередь пуста
+def get_next_notification_time(conn):
+    cursor = conn.execute("SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = 'pending'")
+    return cursor.fetchone()[0]
+
+
+# Учёт результата отправки сообщения рассылки (column - 'sent' или 'failed').
+# Возвращает (broadcast_id, admin_chat_id, total, sent, failed), если это было
+# последнее сообщение рассылки, иначе None.
+def _count_broadcast_result(conn, broadcast_id, column):
+    if broadcast_id is None:
+        return None
+
+    cursor = conn.execute(f"""
+        UPDATE broadcasts SET {column} = {column} + 1
+        WHERE id = ?
+        RETURNING id, admin_chat_id, total, sent, failed
+    """, (broadcast_id,))
+    broadcast = cursor.fetchone()
+    if broadcast and broadcast[3] + broadcast[4] == broadcast[2]:
+        return broadcast
+    return None
+
+
+# Уведомление отправлено - удаляем его из очереди.
+# Возвращает итоги рассылки, если оно было последним в ней (см. _count_broadcast_result).
+def mark_notification_sent(conn, notification_id):
+    cursor = conn.execute(
+        "DELETE FROM notification_outbox WHERE id = ? RETURNING broadcast_id", (notification_id,)
+    )
+    row = cursor.fetchone()
+    return _count_broadcast_result(conn, row[0], 'sent') if row else None
+
+
+# Перенос отправки на next_attempt_at; failed - попытка была неудачной
+# (ограничение скорости Telegram попыткой не считается)
+def reschedule_notification(conn, notification_id, next_attempt_at, error=None, failed=True):
+    conn.execute("""
+        UPDATE notification_outbox
+        SET next_attempt_at = ?, attempts = attempts + ?, last_error = COALESCE(?, last_error)
+        WHERE id = ?
+    """, (next_attempt_at, 1 if failed else 0, error, notification_id))
+
+
+# Уведомление не может быть доставлено (бот заблокирован, чат не найден, исчерпаны попытки).
+# Возвращает итоги рассылки, если оно было последним в ней (см. _count_broadcast_result).
+def mark_notification_failed(conn, notification_id, error):
+    cursor = conn.execute("""
+        UPDATE notification_outbox
+        SET status = 'failed', attempts = attempts + 1, last_error = ?
+        WHERE id = ?
+        RETURNING broadcast_id
+    """, (error, notification_id))
+    row = cursor.fetchone()
+    return _count_broadcast_result(conn, row[0], 'failed') if row else None
+
+
+# Количество получателей рассылки: активные сотрудники с привязанным Telegram
+def count_broadcast_recipients(conn):
+    cursor = conn.execute("SELECT COUNT(*) FROM employees WHERE active = 1 AND telegram_id IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+# Создание рассылки: одно сообщение в очереди уведомлений на каждого получателя,
+# всё в одной транзакции. Возвращает (ID рассылки, количество получателей).
+def create_broadcast(conn, text, admin_chat_id, now):
+    cursor = conn.execute("""
+        INSERT INTO broadcasts (text, admin_chat_id, created_at, total)
+        VALUES (?, ?, ?, 0)
+        RETURNING id
+    """, (text, admin_chat_id, now))
+    broadcast_id = cursor.fetchone()[0]
+
+    cursor = conn.execute("""
+        INSERT INTO notification_outbox (chat_id, text, created_at, next_attempt_at, broadcast_id)
+        SELECT telegram_id, ?, ?, ?, ?
+        FROM employees
+        WHERE active = 1 AND telegram_id IS NOT NULL
+    """, (text, now, now, broadcast_id))
+    total = cursor.rowcount
+
+    conn.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (total, broadcast_id))
+    return broadcast_id, total
+
+
+# Последняя рассылка: (id, created_at, total, sent, failed) или None
+def get_last_broadcast(conn):
+    cursor = conn.execute("""
+        SELECT id, created_at, total, sent, failed
+        FROM broadcasts
+        ORDER BY id DESC
+        LIMIT 1
+    """)
+    return cursor.fetchone()
+
+
+# Недоставленные сообщения рассылки: (имя сотрудника или Telegram ID, ошибка)
+def get_broadcast_failures(conn, broadcast_id):
+    cursor = conn.execute("""
+        SELECT COALESCE(e.name, o.chat_id), o.last_error
+        FROM notification_outbox o
+        LEFT JOIN employees e ON e.telegram_id = o.chat_id
+        WHERE o.broadcast_id = ? AND o.status = 'failed'
+        ORDER BY o.id
+    """, (broadcast_id,))
+    return cursor.fetchall()
+
+
+# Первый день (номер суток) раньше cutoff_day, начиная с from_day, за который
+# в горячей таблице ещё есть выполненные задачи, или None
+def get_next_day_to_archive(conn, from_day, cutoff_day):
+    cursor = conn.execute(
+        "SELECT MIN(end_time) FROM completed_tasks WHERE end_time >= ? AND end_time < ?",
+        (from_day * SECONDS_PER_DAY, cutoff_day * SECONDS_PER_DAY)
+    )
+    first_end_time = cursor.fetchone()[0]
+    return None if first_end_time is None else first_end_time // SECONDS_PER_DAY
+
+
+# Перенос выполненных задач за сутки day из горячей таблицы в архив.
+# Задачи переносятся, только если они уже учтены в суточных сводках (отчёты за целые
+# сутки берутся из сводок, а не из строк). Возвращает количество перенесённых строк
+# или None, если сводка за этот день не совпадает со строками.
+# Транзакция между двумя файлами в режиме WAL не атомарна: после сбоя строки могут
+# остаться в обеих таблицах, поэтому строки, уже попавшие в архив, учитываются один раз
+# и при повторном переносе пропускаются.
+def archive_day(conn, day):
+    day_range = (day * SECONDS_PER_DAY, (day + 1) * SECONDS_PER_DAY)
+
+    cursor = conn.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT id FROM completed_tasks WHERE end_time >= ? AND end_time < ?
+            UNION
+            SELECT id FROM archive.completed_tasks WHERE end_time >= ? AND end_time < ?
+        )
+    """, day_range + day_range)
+    task_count = cursor.fetchone()[0]
+    cursor = conn.execute(
+        "SELECT COALESCE(SUM(task_count), 0) FROM daily_employee_stats WHERE day = ?", (day,)
+    )
+    if cursor.fetchone()[0] != task_count:
+        return None
+
+    conn.execute("""
+        INSERT OR IGNORE INTO archive.completed_tasks
+        (id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds)
+        SELECT id, employee_id, task_id, start_time, end_time, points_earned, duration_seconds
+        FROM completed_tasks
+        WHERE end_time >= ? AND end_time < ?
+    """, day_range)
+    cursor = conn.execute("DELETE FROM completed_tasks WHERE end_time >= ? AND end_time < ?", day_range)
+    return cursor.rowcount
@@ -0,0 +1,63 @@
+import math
+
+# Скетчи квантилей времени выполнения задач (по принципу DDSketch).
+# Время раскладывается по логарифмическим корзинам: корзина i содержит значения
+# из (GAMMA^(i-1), GAMMA^i], поэтому любой квантиль восстанавливается с относительной
+# погрешностью не больше RELATIVE_ACCURACY. Скетч - это только счётчики корзин:
+# их можно хранить в базе построчно, увеличивать при завершении задачи и складывать
+# между собой (за несколько дней, за весь период), не читая историю выполненных задач.
+
+# Относительная точность квантилей. Номера корзин хранятся в базе, поэтому после
+# изменения точности скетчи нужно пересчитать (/rebuild_rollups).
+RELATIVE_ACCURACY = 0.01
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Корзина для времени меньше секунды
+ZERO_BUCKET = -1
+
+
+# Номер корзины для времени в секундах
+def bucket_index(seconds):
+    if seconds < 1:
+        return ZERO_BUCKET
+    return math.ceil(math.log(seconds) / _LOG_GAMMA)
+
+
+# Значение, которым представлены все значения корзины (секунды)
+def bucket_value(bucket):
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+class DurationSketch:
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def add(self, seconds, count=1):
+        self.add_bucket(bucket_index(seconds), count)
+
+    def add_bucket(self, bucket, count):
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += count
+
+    # Добавление всех значений другого скетча
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.add_bucket(bucket, count)
+
+    # Квантиль q (от 0 до 1) в секундах или None для пустого скетча
+    def quantile(self, q):
+        if not self.total:
+            return None
+
+        rank = q * (self.total - 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen > rank:
+                return bucket_value(bucket)
+        return bucket_value(max(self.counts))
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Параллельная обработка обновлений Telegram.
+# Обновления разных чатов обрабатываются одновременно (не больше MAX_CONCURRENT_UPDATES),
+# поэтому тяжёлый отчёт администратора не задерживает сотрудников. Обновления одного
+# чата выполняются строго по очереди в порядке поступления: состояние ConversationHandler
+# и user_data одного пользователя никогда не меняются двумя обработчиками сразу.
+# Обновление сначала дожидается своей очереди в чате и только потом занимает одно
+# из MAX_CONCURRENT_UPDATES мест: обновления, ждущие занятый чат, мест не занимают
+# и не задерживают другие чаты.
+
+# Сколько обновлений обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = 16
+
+# Ограничение, которое передаётся в BaseUpdateProcessor: его семафор берётся до
+# do_process_update, поэтому он не должен ограничивать раньше очереди чата
+_UNLIMITED_UPDATES = 1_000_000
+
+
+# Чат, в пределах которого обновления выполняются по очереди (для обновлений без чата -
+# пользователь), или None, если обновление ни к кому не относится
+def _serialization_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return ('chat', update.effective_chat.id)
+    if update.effective_user is not None:
+        return ('user', update.effective_user.id)
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(_UNLIMITED_UPDATES)
+        # Места для одновременной обработки (занимаются после очереди чата)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Ключ -> [блокировка, количество обновлений, ожидающих или держащих её]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = _serialization_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке очереди
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._locks:
+            logger.warning(f"Остановка при незавершённой обработке обновлений в {len(self._locks)} чатах")
+
+
+# Очередь обновлений с ограничением числа принятых, но ещё не обработанных обновлений.
+# При параллельной обработке Application сразу забирает обновления из очереди и создаёт
+# для каждого задачу, поэтому ограничение размера самой очереди не сдерживает приём.
+# Здесь место занимается при постановке в очередь (put) и освобождается в task_done,
+# который Application вызывает после завершения обработки обновления. Пока мест нет,
+# put ждёт - вместе с ним ждёт ответ на запрос webhook или следующий опрос Telegram.
+class UpdateQueue(asyncio.Queue):
+    def __init__(self, max_pending_updates):
+        super().__init__()
+        self._max_pending_updates = max_pending_updates
+        self._pending_updates = 0
+        self._slot_freed = asyncio.Event()
+
+    async def put(self, item):
+        while self._pending_updates >= self._max_pending_updates:
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        if self._pending_updates >= self._max_pending_updates:
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+        self._pending_updates += 1
+
+    def task_done(self):
+        super().task_done()
+        self._pending_updates -= 1
+        self._slot_freed.set()